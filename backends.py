@@ -0,0 +1,286 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import increment, span
+
+# Status HTTP considerados transitórios (modelo carregando, limite de requisições, falhas do servidor)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Tamanho máximo (MB) aceito para o corpo de uma resposta e tamanho dos blocos lidos do socket
+MAX_RESPONSE_MB = float(os.environ.get("AIBABY_MAX_RESPONSE_MB", "32"))
+RESPONSE_CHUNK_SIZE = 256 * 1024
+
+# URL padrão de cada backend HTTP
+HF_API_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
+HF_IMG2IMG_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-refiner-1.0"
+STUB_API_URL = "http://127.0.0.1:8765/models/stub"
+
+# Modelo padrão do backend local `diffusers`
+DIFFUSERS_MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+
+
+class APIError(Exception):
+    """Falha retornada pela API de inferência, com o status HTTP e a mensagem de erro."""
+
+    def __init__(self, status_code, message, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+        self.phase = None
+
+    @property
+    def retryable(self):
+        """Indica se a falha é transitória (erro de conexão, modelo carregando, limite de requisições)."""
+        return self.status_code is None or self.status_code in RETRYABLE_STATUS_CODES
+
+
+def parse_retry_after(value):
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos de espera."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        with span("upstream_connect", host=self.host):
+            super().connect()
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        with span("upstream_connect", host=self.host):
+            super().connect()
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Adaptador HTTP que mede a abertura de cada nova conexão (DNS, TCP e TLS) no span `upstream_connect`."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+
+def read_body(response, max_bytes):
+    """Lê o corpo da resposta em blocos e retorna seus bytes, ou None (fechando a conexão) se ele passar de `max_bytes`.
+
+    O Content-Length, quando informado, é conferido antes de ler qualquer byte."""
+    declared = response.headers.get("Content-Length", "")
+    if declared.isdigit() and int(declared) > max_bytes:
+        response.close()
+        return None
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=RESPONSE_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            response.close()
+            return None
+        chunks.append(chunk)
+    # Com um único bloco, `join` devolve o próprio objeto, sem cópia
+    return b"".join(chunks)
+
+
+def build_http_session(pool_size, keep_alive=True):
+    """Cria uma sessão HTTP com pool de conexões reaproveitáveis."""
+    session = requests.Session()
+    adapter = TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+class InferenceBackend:
+    """Interface dos backends de geração: recebe o payload da API e retorna os bytes da imagem."""
+
+    name = "base"
+
+    # Backends locais não exigem a chave de API do usuário
+    requires_api_key = False
+
+    # Identifica o modelo/servidor nas chaves do cache de resultados
+    url = ""
+
+    def generate(self, payload, headers, read_timeout):
+        """Gera a imagem do payload e retorna seus bytes, levantando APIError em caso de falha."""
+        raise NotImplementedError
+
+    def health_check(self, timeout):
+        """Indica se o backend está respondendo; usado pelo pool de endpoints."""
+        return True
+
+
+class HTTPInferenceBackend(InferenceBackend):
+    """Backend que fala o protocolo da API de Inferência da Hugging Face via HTTP."""
+
+    name = "hf"
+    requires_api_key = True
+
+    def __init__(self, url, session, connect_timeout, max_response_bytes=None):
+        self.url = url
+        self.session = session
+        self.connect_timeout = connect_timeout
+        self.max_response_bytes = max_response_bytes or int(MAX_RESPONSE_MB * 1024 * 1024)
+
+    def generate(self, payload, headers, read_timeout):
+        # O corpo é lido separadamente, em blocos, para medir o tempo até o primeiro byte (TTFB) e o download
+        with span("upstream_request", backend=self.name):
+            try:
+                with span("upstream_ttfb"):
+                    response = self.session.post(self.url, headers=headers, json=payload, timeout=(self.connect_timeout, read_timeout), stream=True)
+                with span("upstream_download"):
+                    body = read_body(response, self.max_response_bytes)
+            except requests.Timeout:
+                increment("upstream_responses_total", help_text="Respostas do backend por status HTTP.", backend=self.name, status="timeout")
+                raise APIError(None, "Tempo limite de resposta da API excedido.") from None
+            except requests.RequestException as exc:
+                increment("upstream_responses_total", help_text="Respostas do backend por status HTTP.", backend=self.name, status="conexão")
+                raise APIError(None, f"Falha de conexão com a API: {exc}") from None
+        if body is None:
+            increment("upstream_responses_total", help_text="Respostas do backend por status HTTP.", backend=self.name, status="grande demais")
+            raise APIError(response.status_code, f"A resposta da API excede o limite de {self.max_response_bytes / (1024 * 1024):g} MB.")
+        increment("upstream_responses_total", help_text="Respostas do backend por status HTTP.", backend=self.name, status=response.status_code)
+        if response.status_code == 200:
+            return body
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        try:
+            error_body = json.loads(body)
+            error_message = error_body.get('error', 'Erro desconhecido.')
+        except (ValueError, AttributeError):
+            raise APIError(response.status_code, body.decode("utf-8", "replace"), retry_after) from None
+        # Enquanto o modelo é carregado, a API responde 503 com o tempo estimado de espera
+        if error_body.get('estimated_time') is not None:
+            retry_after = max(retry_after or 0.0, float(error_body['estimated_time']))
+        raise APIError(response.status_code, error_message, retry_after)
+
+    def health_check(self, timeout):
+        # Qualquer resposta abaixo de 500 indica que o servidor está no ar
+        try:
+            return self.session.get(self.url, timeout=(self.connect_timeout, timeout)).status_code < 500
+        except requests.RequestException:
+            return False
+
+
+class StubInferenceBackend(HTTPInferenceBackend):
+    """Backend HTTP apontado para o servidor local `stub_server.py`, para testes de carga sem gastar cota."""
+
+    name = "stub"
+    requires_api_key = False
+
+
+class DiffusersBackend(InferenceBackend):
+    """Backend local que roda o pipeline do `diffusers` na CPU (ou GPU, se disponível)."""
+
+    name = "diffusers"
+
+    def __init__(self, model_id, device=None):
+        self.model_id = model_id
+        self.url = f"diffusers://{model_id}"
+        self.device = device
+        self._pipeline = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            import torch
+            from diffusers import AutoPipelineForImage2Image, AutoPipelineForText2Image
+        except ImportError:
+            raise APIError(None, "O backend 'diffusers' requer os pacotes 'diffusers' e 'torch' instalados.") from None
+        device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+        pipeline = AutoPipelineForText2Image.from_pretrained(self.model_id).to(device)
+        # O pipeline image-to-image reaproveita os pesos já carregados
+        return pipeline, AutoPipelineForImage2Image.from_pipe(pipeline), torch, device
+
+    def generate(self, payload, headers, read_timeout):
+        parameters = dict(payload.get("parameters") or {})
+        # O pipeline não é thread-safe: uma geração por vez
+        with self._lock:
+            if self._pipeline is None:
+                self._pipeline = self._load()
+            text_pipeline, image_pipeline, torch, device = self._pipeline
+            seed = parameters.pop("seed", None)
+            generator = torch.Generator(device=device).manual_seed(seed) if seed is not None else None
+            with span("upstream_request", backend=self.name):
+                # Payloads image-to-image trazem a imagem inicial em `inputs` e o prompt nos parâmetros
+                if "prompt" in parameters:
+                    init_image = decode_init_image(payload["inputs"])
+                    image = image_pipeline(image=init_image, generator=generator, **parameters).images[0]
+                else:
+                    image = text_pipeline(prompt=payload["inputs"], generator=generator, **parameters).images[0]
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        return buf.getvalue()
+
+
+class BlendBackend(InferenceBackend):
+    """Substituto local e leve (CPU) de um backend image-to-image, para testar o modo com as fotos dos pais.
+
+    Não usa nenhum modelo: mistura a imagem inicial com um tom derivado do prompt e da semente, na
+    proporção de `strength`, de modo que prompts e sementes diferentes geram imagens diferentes."""
+
+    name = "blend"
+    url = "blend://local"
+
+    def generate(self, payload, headers, read_timeout):
+        parameters = payload.get("parameters") or {}
+        if "prompt" not in parameters:
+            raise APIError(400, "O backend 'blend' aceita apenas payloads image-to-image.")
+        with span("upstream_request", backend=self.name):
+            init_image = decode_init_image(payload["inputs"])
+            digest = hashlib.sha256(f"{parameters['prompt']}\n{parameters.get('seed')}".encode("utf-8")).digest()
+            tint = Image.new("RGB", init_image.size, tuple(digest[:3]))
+            image = Image.blend(init_image, tint, 0.5 * float(parameters.get("strength", 0.8)))
+            buf = io.BytesIO()
+            image.save(buf, format="PNG", compress_level=1)
+        return buf.getvalue()
+
+
+def decode_init_image(value):
+    """Decodifica a imagem inicial (base64) de um payload image-to-image."""
+    try:
+        return Image.open(io.BytesIO(base64.b64decode(value))).convert("RGB")
+    except (ValueError, OSError):
+        raise APIError(400, "Imagem inicial inválida no payload image-to-image.") from None
+
+
+def create_backend(name, session=None, connect_timeout=5.0, url=None, model_id=DIFFUSERS_MODEL_ID):
+    """Cria o backend de inferência pelo nome ('hf', 'stub', 'diffusers' ou 'blend')."""
+    if name == "hf":
+        return HTTPInferenceBackend(url or HF_API_URL, session, connect_timeout)
+    if name == "stub":
+        return StubInferenceBackend(url or STUB_API_URL, session, connect_timeout)
+    if name == "diffusers":
+        return DiffusersBackend(model_id)
+    if name == "blend":
+        return BlendBackend()
+    raise ValueError(f"Backend de inferência desconhecido: {name!r}")
@@ -0,0 +1,285 @@
+"""Geração em lote, sem o Streamlit, a partir de um manifesto CSV ou JSONL de configurações.
+
+Cada linha do manifesto descreve uma configuração: `id` (opcional, vira o nome da pasta), `gender` ('Menino', 'Menina' ou
+'Aleatório'), `skin_tone` (rótulo de prompts.SKIN_TONES), `phases` (vazio = todas), `seeds` (vazio = 0)
+e `grid` (1 para montar também a grade das fases de cada semente). No CSV, listas são separadas por ';'.
+
+As imagens vão para `<saida>/<id>/` e cada resultado é registrado em `<saida>/results.jsonl` assim que
+fica pronto. Uma execução interrompida continua de onde parou: o que já está no manifesto de
+resultados (e no disco) não é gerado de novo, e as falhas são tentadas outra vez. Uma linha editada
+(ex.: outro gênero ou tom de pele para o mesmo `id`) tem suas imagens geradas de novo.
+
+Uso:
+    python batch.py configs.csv --output lote --token hf_...
+    python batch.py configs.jsonl --output lote --backend stub --workers 8
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import time
+import unicodedata
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PIL import Image
+
+from backends import build_http_session, create_backend
+from generation import MAX_CONCURRENT_REQUESTS, build_payload, fetch_image
+from imaging import OUTPUT_FORMATS, write_image_grid
+from prompts import GENDERS, PHASES, SKIN_TONES, get_prompt
+from result_cache import ResultCache
+
+# Nome do manifesto de resultados gravado no diretório de saída
+RESULTS_FILE = "results.jsonl"
+
+# Uma imagem a gerar: configuração de origem, fase, gênero, tom de pele e semente
+BatchItem = namedtuple("BatchItem", ("key", "config", "phase", "gender", "skin_tone", "seed"))
+
+
+class ManifestError(ValueError):
+    """O manifesto de configurações tem uma linha inválida."""
+
+
+def slugify(text):
+    """Converte um rótulo ('Bebê') em um nome de arquivo sem acentos ('bebe')."""
+    ascii_text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return "_".join(ascii_text.lower().split())
+
+
+def _split(value):
+    # No CSV as listas vêm como 'Bebê;Criança'; no JSONL podem ser listas ou o mesmo formato de texto
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in str(value).split(";") if item.strip()]
+
+
+def parse_config(row, line):
+    """Valida uma linha do manifesto e retorna a configuração normalizada."""
+    config_id = str(row.get("id") or f"config_{line}").strip()
+    # O id vira o nome da pasta das imagens: não pode apontar para fora do diretório de saída
+    if config_id in (".", "..") or any(separator in config_id for separator in ("/", "\\", ":")):
+        raise ManifestError(f"Linha {line}: id {config_id!r} inválido; ele vira o nome de uma pasta e não pode conter '/', '\\' ou ':' nem ser '.' ou '..'.")
+    gender = str(row.get("gender") or "Aleatório").strip()
+    skin_tone = str(row.get("skin_tone") or "Automático").strip()
+    # Fases e sementes repetidas gerariam duas vezes a mesma imagem, no mesmo arquivo
+    phases = list(dict.fromkeys(_split(row.get("phases")))) or list(PHASES)
+    try:
+        seeds = list(dict.fromkeys(int(seed) for seed in _split(row.get("seeds")))) or [0]
+    except ValueError:
+        raise ManifestError(f"Linha {line}: as sementes devem ser números inteiros.") from None
+    if gender != "Aleatório" and gender not in GENDERS:
+        raise ManifestError(f"Linha {line}: gênero {gender!r} inválido; use {', '.join(GENDERS)} ou Aleatório.")
+    if skin_tone not in SKIN_TONES:
+        raise ManifestError(f"Linha {line}: tom de pele {skin_tone!r} inválido; use um de {', '.join(SKIN_TONES)}.")
+    unknown = [phase for phase in phases if phase not in PHASES]
+    if unknown:
+        raise ManifestError(f"Linha {line}: fase {unknown[0]!r} inválida; use {', '.join(PHASES)}.")
+    if gender == "Aleatório":
+        # Sorteio fixo por configuração: uma execução retomada gera o mesmo gênero que a original
+        gender = random.Random(config_id).choice(GENDERS)
+    grid = str(row.get("grid") or "").strip().lower() in ("1", "true", "sim", "yes")
+    return {"id": config_id, "gender": gender, "skin_tone": skin_tone, "phases": phases, "seeds": seeds, "grid": grid}
+
+
+def load_manifest(path):
+    """Lê o manifesto (CSV com cabeçalho ou JSONL, pela extensão) e retorna a lista de configurações validadas."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            rows = [(line, row) for line, row in enumerate(csv.DictReader(f), 2)]
+        else:
+            rows = []
+            for line, text in enumerate(f, 1):
+                if not text.strip():
+                    continue
+                try:
+                    rows.append((line, json.loads(text)))
+                except json.JSONDecodeError:
+                    raise ManifestError(f"Linha {line}: JSON inválido.") from None
+    configs = [parse_config(row, line) for line, row in rows]
+    duplicated = [config_id for config_id, count in Counter(config["id"] for config in configs).items() if count > 1]
+    if duplicated:
+        raise ManifestError(f"Id de configuração repetido: {duplicated[0]!r}.")
+    return configs
+
+
+def expand_manifest(configs):
+    """Expande as configurações em uma lista de `BatchItem`, uma por imagem (fase × semente)."""
+    return [
+        BatchItem(f"{config['id']}/{slugify(phase)}/{seed}", config["id"], phase, config["gender"], config["skin_tone"], seed)
+        for config in configs
+        for seed in config["seeds"]
+        for phase in config["phases"]
+    ]
+
+
+def load_results(output_dir):
+    """Lê o manifesto de resultados de uma execução anterior: {chave: último registro}."""
+    results = {}
+    path = os.path.join(output_dir, RESULTS_FILE)
+    if not os.path.exists(path):
+        return results
+    with open(path, encoding="utf-8") as f:
+        for text in f:
+            try:
+                record = json.loads(text)
+            except json.JSONDecodeError:
+                # Última linha cortada por uma interrupção no meio da escrita
+                continue
+            results[record["key"]] = record
+    return results
+
+
+def _is_done(record, output_dir, **expected):
+    # `expected` confere o registro com a linha atual do manifesto: uma linha editada depois da execução anterior não é pulada
+    return (
+        record is not None and record["status"] == "ok" and all(record.get(name) == value for name, value in expected.items())
+        and os.path.exists(os.path.join(output_dir, record["path"]))
+    )
+
+
+def _write_file(path, data):
+    # Grava em um arquivo temporário e troca de uma vez: uma interrupção nunca deixa uma imagem pela metade
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def _image_extension(image_bytes):
+    image_format = Image.open(io.BytesIO(image_bytes)).format or "PNG"
+    return OUTPUT_FORMATS.get(image_format, (None, image_format.lower()))[1]
+
+
+def generate_item(item, output_dir, headers, backend, cache):
+    """Gera a imagem de um item e a grava em `<saida>/<id>/<fase>_<semente>.<ext>`; retorna o caminho relativo."""
+    payload = build_payload(get_prompt(item.phase, item.gender, item.skin_tone).text, item.seed)
+    image_bytes = fetch_image(payload, headers, backend, cache)
+    relative_path = os.path.join(item.config, f"{slugify(item.phase)}_{item.seed}.{_image_extension(image_bytes)}")
+    os.makedirs(os.path.join(output_dir, item.config), exist_ok=True)
+    _write_file(os.path.join(output_dir, relative_path), image_bytes)
+    return relative_path
+
+
+def write_grids(configs, results, output_dir):
+    """Monta a grade de cada semente das configurações com `grid`, quando todas as fases deram certo; retorna os registros novos."""
+    records = []
+    for config in configs:
+        if not config["grid"]:
+            continue
+        for seed in config["seeds"]:
+            key = f"{config['id']}/grade/{seed}"
+            expected = {"gender": config["gender"], "skin_tone": config["skin_tone"]}
+            if _is_done(results.get(key), output_dir, phases=config["phases"], **expected):
+                continue
+            phase_records = [results.get(f"{config['id']}/{slugify(phase)}/{seed}") for phase in config["phases"]]
+            if not all(_is_done(record, output_dir, **expected) for record in phase_records):
+                continue
+            relative_path = os.path.join(config["id"], f"grade_{seed}.png")
+            path = os.path.join(output_dir, relative_path)
+            # As fases são abertas uma a uma, conforme a grade é montada
+            write_image_grid((Image.open(os.path.join(output_dir, record["path"])) for record in phase_records), path + ".tmp", columns=2)
+            os.replace(path + ".tmp", path)
+            records.append({"key": key, "config": config["id"], "seed": seed, "phases": config["phases"], **expected, "status": "ok", "path": relative_path})
+    return records
+
+
+def run_batch(configs, output_dir, headers, backend, cache, max_workers=MAX_CONCURRENT_REQUESTS, on_progress=None):
+    """Gera todas as imagens das configurações com até `max_workers` requisições simultâneas e retorna as contagens.
+
+    Cada resultado é acrescentado a `results.jsonl` assim que fica pronto; os itens já concluídos
+    numa execução anterior são pulados. `on_progress(concluidos, total)` é chamado após cada item."""
+    os.makedirs(output_dir, exist_ok=True)
+    items = expand_manifest(configs)
+    results = load_results(output_dir)
+    pending = [item for item in items if not _is_done(results.get(item.key), output_dir, gender=item.gender, skin_tone=item.skin_tone)]
+    summary = {"total": len(items), "skipped": len(items) - len(pending), "generated": 0, "failed": 0, "grids": 0}
+
+    results_path = os.path.join(output_dir, RESULTS_FILE)
+    if os.path.exists(results_path) and os.path.getsize(results_path):
+        with open(results_path, "rb+") as f:
+            # Uma linha cortada pela interrupção anterior é encerrada, para não emendar no primeiro registro novo
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+    with open(results_path, "a", encoding="utf-8") as results_file:
+        def record(entry):
+            results[entry["key"]] = entry
+            results_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            results_file.flush()
+
+        def generate(item):
+            started = time.monotonic()
+            return generate_item(item, output_dir, headers, backend, cache), time.monotonic() - started
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        futures = {executor.submit(generate, item): item for item in pending}
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                item = futures[future]
+                entry = {"key": item.key, "config": item.config, "phase": item.phase, "gender": item.gender, "skin_tone": item.skin_tone, "seed": item.seed}
+                try:
+                    path, elapsed = future.result()
+                    entry.update(status="ok", path=path, elapsed=round(elapsed, 3))
+                    summary["generated"] += 1
+                except Exception as error:
+                    # Além dos erros da API, uma falha ao gravar (OSError) ou uma resposta que não é imagem
+                    # (UnidentifiedImageError) vira uma linha com falha, sem interromper o lote
+                    entry.update(status="failed", status_code=getattr(error, "status_code", None), error=getattr(error, "message", str(error)))
+                    summary["failed"] += 1
+                record(entry)
+                if on_progress:
+                    on_progress(summary["skipped"] + done, summary["total"])
+        finally:
+            # Numa interrupção (Ctrl+C), os itens ainda não iniciados são descartados; o resto fica para a próxima execução
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+        for entry in write_grids(configs, results, output_dir):
+            record(entry)
+            summary["grids"] += 1
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera em lote as imagens de um manifesto CSV ou JSONL de configurações.")
+    parser.add_argument("manifest", help="Arquivo .csv (com cabeçalho) ou .jsonl com as configurações.")
+    parser.add_argument("--output", required=True, help="Diretório das imagens e do manifesto de resultados.")
+    parser.add_argument("--backend", default=os.environ.get("AIBABY_BACKEND", "hf"), help="Backend de inferência ('hf', 'stub' ou 'diffusers').")
+    parser.add_argument("--url", default=os.environ.get("AIBABY_API_URL") or None, help="URL do modelo.")
+    parser.add_argument("--cache-dir", default=os.environ.get("AIBABY_CACHE_DIR", ""), help="Camada em disco do cache de resultados, compartilhada com o app e a galeria.")
+    parser.add_argument("--token", default=os.environ.get("AIBABY_BATCH_TOKEN", ""), help="Chave de API da Hugging Face.")
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENT_REQUESTS, help="Gerações simultâneas.")
+    args = parser.parse_args()
+
+    try:
+        configs = load_manifest(args.manifest)
+    except (OSError, ManifestError) as error:
+        parser.error(str(error))
+    backend = create_backend(args.backend, build_http_session(max(4, args.workers)), url=args.url)
+    if backend.requires_api_key and not args.token:
+        parser.error("o backend exige uma chave de API: use --token ou AIBABY_BATCH_TOKEN.")
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    # As imagens já ficam no diretório de saída: a camada em memória do cache não é necessária
+    cache = ResultCache(0, directory=args.cache_dir)
+
+    def on_progress(done, total):
+        print(f"\r{done}/{total} imagens", end="", flush=True)
+
+    try:
+        summary = run_batch(configs, args.output, headers, backend, cache, max_workers=args.workers, on_progress=on_progress)
+    except KeyboardInterrupt:
+        print("\nInterrompido. Execute o mesmo comando para continuar de onde parou.")
+        return 130
+    print(f"\n{summary['generated']} geradas, {summary['skipped']} já estavam prontas, {summary['failed']} falharam, {summary['grids']} grades montadas.")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Benchmark reproduzível do pipeline de geração contra o servidor stub local.
+
+Mede latência e memória de cada etapa (montagem do prompt, requisição, decodificação,
+grade e codificação PNG) nos caminhos de imagem única e de todas as fases, além da vazão
+com N sessões simultâneas. O caminho das fases segue o job de grade do app (core.grid_job):
+cada fase é colada na grade assim que chega e a grade só vira PNG no download. Os resultados são gravados em JSON; com `--compare` o
+benchmark é comparado com uma execução anterior e termina com código 1 se houver regressão.
+
+Uso:
+    python benchmark.py --iterations 20 --sessions 1 4 16 --output bench.json
+    python benchmark.py --output novo.json --compare bench.json --threshold 0.2
+"""
+import argparse
+import io
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import PIL
+from PIL import Image
+
+from backends import build_http_session, create_backend
+from core import DISPLAY_QUALITY, encode_download
+from generation import build_payload, fetch_image, generate_phases
+from imaging import PNG_COMPRESS_LEVEL, IncrementalGrid, encode_image
+from prompts import PHASES, get_prompt
+from result_cache import ResultCache
+from stub_server import start_in_background
+
+SKIN_TONE = 'Automático'
+
+
+def summarize(samples):
+    """Resume uma lista de durações (segundos) em estatísticas em milissegundos."""
+    ordered = sorted(samples)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[p95_index] * 1000,
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+class StageTimer:
+    """Acumula as durações de cada etapa nomeada."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def measure(self, stage, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.samples.setdefault(stage, []).append(time.perf_counter() - started)
+        return result
+
+    def report(self):
+        return {stage: summarize(samples) for stage, samples in self.samples.items()}
+
+
+def decode(image_bytes):
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    return image
+
+
+def run_single(backend, timer, seed):
+    """Executa o caminho de imagem única uma vez, medindo cada etapa."""
+    payload = timer.measure("prompt_build", lambda: build_payload(get_prompt('Bebê', 'Menina', SKIN_TONE).text, seed))
+    # Cache com capacidade zero: toda chamada vai ao backend
+    image_bytes = timer.measure("request", fetch_image, payload, {}, backend, ResultCache(0))
+    timer.measure("decode", decode, image_bytes)
+    return image_bytes
+
+
+def run_phases(backend, timer, seed):
+    """Executa o caminho de todas as fases uma vez, como o job de grade do app, medindo cada etapa."""
+    payloads = timer.measure("prompt_build", lambda: {
+        phase: build_payload(get_prompt(phase, 'Menino', SKIN_TONE).text, seed) for phase in PHASES
+    })
+    grid = IncrementalGrid(len(PHASES), columns=2)
+
+    def on_phase_done(phase, image_bytes, done):
+        image = timer.measure("decode", decode, image_bytes)
+        tile = timer.measure("grid", grid.paste, PHASES.index(phase), image)
+        timer.measure("tile_jpeg", encode_image, tile, "JPEG", quality=DISPLAY_QUALITY)
+
+    # Como no app, decodificação e colagem acontecem enquanto as demais fases ainda estão em andamento,
+    # então "request" inclui o tempo de cada bloco que não se sobrepôs às requisições
+    timer.measure("request", generate_phases, payloads, {}, backend, ResultCache(0), on_done=on_phase_done, keep=False)
+    raw = timer.measure("grid_raw", grid.image.tobytes)
+    meta = {"kind": "raw", "mode": grid.image.mode, "size": grid.image.size}
+    return timer.measure("encode_png", encode_download, raw, meta, "PNG", PNG_COMPRESS_LEVEL)
+
+
+def run_cache_hit(backend, iterations):
+    """Mede o caminho de acerto do cache de resultados."""
+    cache = ResultCache(64 * 1024 * 1024)
+    payload = build_payload(get_prompt('Criança', 'Menino', SKIN_TONE).text)
+    fetch_image(payload, {}, backend, cache)
+    timer = StageTimer()
+    for _ in range(iterations):
+        timer.measure("cache_hit", fetch_image, payload, {}, backend, cache)
+    return timer.report()["cache_hit"]
+
+
+def measure_memory(func):
+    """Retorna o pico de memória Python (KB) alocada durante `func`."""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def run_throughput(backend, sessions, grids_per_session):
+    """Simula `sessions` sessões gerando grades simultaneamente e mede a vazão."""
+    latencies = []
+
+    def session_worker(index):
+        for grid in range(grids_per_session):
+            started = time.perf_counter()
+            run_phases(backend, StageTimer(), seed=index * 1000 + grid)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(session_worker, range(sessions)))
+    elapsed = time.perf_counter() - started
+    total_grids = sessions * grids_per_session
+    return {
+        "sessions": sessions,
+        "grids": total_grids,
+        "elapsed_s": elapsed,
+        "grids_per_s": total_grids / elapsed,
+        "requests_per_s": total_grids * len(PHASES) / elapsed,
+        "grid_latency": summarize(latencies),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Lista as etapas cuja mediana piorou mais que `threshold` (fração) em relação ao baseline."""
+    regressions = []
+    for path in ("single", "phases"):
+        for stage, stats in current[path].items():
+            previous = baseline.get(path, {}).get(stage)
+            if previous and stats["median_ms"] > previous["median_ms"] * (1 + threshold):
+                regressions.append(f"{path}.{stage}: {previous['median_ms']:.2f} ms -> {stats['median_ms']:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de geração contra o servidor stub.")
+    parser.add_argument("--iterations", type=int, default=20, help="Repetições de cada caminho.")
+    parser.add_argument("--warmup", type=int, default=2, help="Repetições descartadas antes da medição.")
+    parser.add_argument("--sessions", type=int, nargs="*", default=[1, 4, 16], help="Números de sessões simultâneas para o teste de vazão.")
+    parser.add_argument("--grids-per-session", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latência simulada do backend, em segundos.")
+    parser.add_argument("--size", type=int, default=1024, help="Tamanho das imagens devolvidas pelo stub.")
+    parser.add_argument("--output", default="bench.json", help="Arquivo JSON de saída.")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para detectar regressões.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Piora relativa tolerada na mediana de cada etapa.")
+    args = parser.parse_args()
+
+    server, url = start_in_background(port=0, latency=args.latency, size=args.size)
+    session = build_http_session(max(16, max(args.sessions or [1]) * len(PHASES)))
+    backend = create_backend("stub", session, connect_timeout=5.0, url=url)
+
+    try:
+        for seed in range(args.warmup):
+            run_single(backend, StageTimer(), seed)
+            run_phases(backend, StageTimer(), seed)
+
+        single_timer, phases_timer = StageTimer(), StageTimer()
+        for seed in range(args.iterations):
+            run_single(backend, single_timer, seed)
+            run_phases(backend, phases_timer, seed)
+
+        results = {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "git_revision": git_revision(),
+                "python": sys.version.split()[0],
+                "pillow": PIL.__version__,
+                "platform": platform.platform(),
+                "iterations": args.iterations,
+                "latency_s": args.latency,
+                "image_size": args.size,
+            },
+            "single": single_timer.report(),
+            "phases": phases_timer.report(),
+            "cache": run_cache_hit(backend, args.iterations),
+            "memory": {
+                "single_python_peak_kb": measure_memory(lambda: run_single(backend, StageTimer(), 0)),
+                "phases_python_peak_kb": measure_memory(lambda: run_phases(backend, StageTimer(), 0)),
+            },
+            "throughput": [run_throughput(backend, n, args.grids_per_session) for n in args.sessions],
+        }
+        results["memory"]["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(results, handle, indent=2)
+
+    for path in ("single", "phases"):
+        for stage, stats in results[path].items():
+            print(f"{path:>6} {stage:<13} mediana {stats['median_ms']:8.2f} ms   p95 {stats['p95_ms']:8.2f} ms")
+    for row in results["throughput"]:
+        print(f"{row['sessions']:>3} sessões: {row['grids_per_s']:.2f} grades/s, {row['requests_per_s']:.2f} req/s")
+    print(f"Resultados gravados em {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            regressions = compare(results, json.load(handle), args.threshold)
+        if regressions:
+            print("Regressões detectadas:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("Nenhuma regressão detectada.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,22 @@
 import streamlit as st
-import requests
-from PIL import Image
-import io
+import hashlib
 import random
+import time
+import uuid
+from core import (
+    AGE_OPTIONS, ENDPOINTS, GENDER_OPTIONS, IMAGE_STORE_TTL, JOB_POLL_INTERVAL, MAX_VARIATIONS, PREVIEW_DEFAULT, SKIN_TONE_OPTIONS, Services,
+    build_request, choose_seed, create_conditioning_backend, create_gallery_refresher, create_http_session, create_image_store,
+    create_inference_backend, create_job_manager, create_result_cache, create_resume_store, create_scheduler, create_shared_store,
+    create_single_flight, display_bytes, encode_download, grid_job, issue_resume_token, requires_api_key, resolve_gender, resume_session,
+    single_job, start_metrics, upgrade_job, variation_labels, variations_job, wants_preview,
+)
+from jobs import FINISHED_STATES, JOB_DONE, JOB_FAILED, JOB_QUEUED
+from metrics import METRICS, span
+from prompts import PHASES, get_prompt
+
+# Este script só monta a página: configuração, serviços e jobs ficam em core.py, e o Pillow e o
+# requests são importados no primeiro uso. O tempo de cada execução é medido até o fim da página.
+run_started = time.perf_counter()
 
 # --- Configuração da Página e Constantes ---
 st.set_page_config(
@@ -12,60 +26,188 @@ st.set_page_config(
 )
 
 # --- INICIALIZAÇÃO DO ESTADO DA SESSÃO ---
-if 'last_image_info' not in st.session_state:
-    st.session_state.last_image_info = None
+# A sessão guarda apenas identificadores; os bytes das imagens ficam no ImageStore do servidor.
+# O id da sessão é definido junto com a interface, depois dos serviços (ver abaixo).
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+if 'download_handles' not in st.session_state:
+    st.session_state.download_handles = {}
+if 'upload_digests' not in st.session_state:
+    st.session_state.upload_digests = {}
 
-# URL da API do Hugging Face para o modelo Stable Diffusion XL
-API_URL = "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0"
+# Fragmentos permitem atualizar só o andamento do job, sem executar a página inteira (Streamlit 1.33+)
+poll_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
 
-# Prompts base para garantir a qualidade e o estilo da imagem
-BASE_PROMPT_TEMPLATE = "ultra realistic 8k photo, {age_desc}, cinematic lighting, professional photography, sharp focus, incredibly detailed"
-NEGATIVE_PROMPT = "hands, fingers, deformed hands, mutated hands, arms, blurry, deformed, ugly, disfigured, cartoon, anime, 3d render, painting, text, watermark, signature, extra limbs, missing limbs, body"
+# --- Funções ---
 
-# Descrições específicas para cada fase da vida
-AGE_PROMPTS = {
-    # --- ALTERAÇÃO AQUI: PROMPT DO BEBÊ DETALHADO ---
-    'Bebê': 'A close-up photo focusing on the serene face of a newborn baby. The baby is swaddled in a white blanket and wears a striped pink and blue hospital beanie. The background is a surface with a soft, out-of-focus pattern of blue and pink stripes, suggesting a nursery setting. The image highlights the baby\'s delicate features and perfect smooth skin.',
-    
-    'Criança': 'cute happy child, 6 years old, smiling, headshot portrait',
-    'Adolescente': 'portrait of a teenager, 16 years old, natural look, high school photo style',
-    'Adulto': 'professional headshot portrait of a young adult, 28 years old, confident expression'
-}
+@st.cache_resource
+def get_http_session():
+    """Cria uma única sessão HTTP com pool de conexões, compartilhada por todas as sessões do Streamlit."""
+    return create_http_session()
 
+@st.cache_resource
+def get_backend():
+    """Cria o backend de inferência configurado, compartilhado por todas as sessões do Streamlit."""
+    return create_inference_backend(get_http_session())
 
-# --- Funções ---
+@st.cache_resource
+def get_conditioning_backend():
+    """Cria o backend image-to-image usado no modo com as fotos dos pais."""
+    return create_conditioning_backend(get_http_session())
 
-def query_api(payload, headers):
-    """Envia um prompt para a API do Hugging Face e retorna o conteúdo da imagem."""
-    response = requests.post(API_URL, headers=headers, json=payload)
-    if response.status_code == 200:
-        return response.content
-    else:
-        try:
-            error_message = response.json().get('error', 'Erro desconhecido.')
-            st.error(f"Erro na API: {error_message} (Status: {response.status_code})")
-            if "must be provided" in error_message:
-                st.error("Verifique se sua Chave de API está correta e foi inserida na barra lateral.")
-            if response.status_code == 403:
-                 st.error("Erro 403: Verifique se você aceitou os termos de uso do modelo no site da Hugging Face.")
-        except:
-            st.error(f"Erro na API (Status: {response.status_code}): {response.text}")
+@st.cache_resource
+def get_shared_store():
+    """Abre uma única vez o estado compartilhado com as outras réplicas do app, se configurado."""
+    return create_shared_store()
+
+@st.cache_resource
+def get_resume_store():
+    """Guarda os tokens de retomada da sessão que vão na URL."""
+    return create_resume_store(get_shared_store())
+
+@st.cache_resource
+def get_result_cache():
+    """Cria o cache de resultados compartilhado por todas as sessões do Streamlit."""
+    return create_result_cache(get_shared_store())
+
+@st.cache_resource
+def get_single_flight():
+    """Cria o agrupador de requisições idênticas em andamento, compartilhado por todas as sessões do Streamlit."""
+    return create_single_flight(get_shared_store())
+
+@st.cache_resource
+def get_scheduler():
+    """Cria a fila global com limite de requisições, compartilhada por todas as sessões do Streamlit."""
+    return create_scheduler(get_shared_store())
+
+@st.cache_resource
+def get_image_store():
+    """Cria o armazenamento de imagens das sessões, compartilhado por todo o servidor."""
+    return create_image_store(get_shared_store())
+
+@st.cache_resource
+def get_job_manager():
+    """Cria o executor de jobs em segundo plano, compartilhado por todas as sessões do Streamlit."""
+    return create_job_manager()
+
+@st.cache_resource
+def get_metrics_server():
+    """Sobe uma única vez o endpoint /metrics do processo, se configurado."""
+    return start_metrics()
+
+@st.cache_resource
+def get_gallery_refresher():
+    """Inicia uma única vez a atualização periódica da galeria pré-gerada, se configurada."""
+    return create_gallery_refresher(get_backend, get_result_cache(), get_scheduler())
+
+def get_services(backend):
+    """Agrupa os serviços compartilhados usados pelos jobs, com o backend escolhido para a geração."""
+    return Services(backend, get_result_cache(), get_single_flight(), get_scheduler(), get_image_store())
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_upload_preview(digest, _upload):
+    """Valida a foto e gera sua miniatura uma única vez por conteúdo (hash), para qualquer sessão."""
+    from uploads import make_preview
+    return make_preview(_upload.getvalue())
+
+def upload_digest(uploaded_file, slot):
+    """Hash do conteúdo da foto, calculado só quando o arquivo do campo `slot` muda, e não a cada execução do script."""
+    file_id, digest = st.session_state.upload_digests.get(slot, (None, None))
+    if file_id != uploaded_file.file_id:
+        file_id, digest = uploaded_file.file_id, hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        st.session_state.upload_digests[slot] = (file_id, digest)
+    return digest
+
+def show_upload(uploaded_file, caption):
+    """Exibe a miniatura da foto enviada e retorna o hash do conteúdo, ou None (com a mensagem de erro) se a foto for recusada."""
+    from uploads import UploadError, check_upload_size
+    try:
+        check_upload_size(uploaded_file.size)
+        digest = upload_digest(uploaded_file, caption)
+        preview = get_upload_preview(digest, uploaded_file)
+    except UploadError as error:
+        st.error(f"⚠️ {error}")
         return None
+    st.image(preview, caption=caption, use_column_width=True)
+    return digest
 
-def create_image_grid(images):
-    """Cria uma imagem única a partir de 4 imagens em uma grade 2x2."""
-    image_size = 512
-    grid_image = Image.new('RGB', (image_size * 2, image_size * 2))
-    
-    grid_image.paste(images[0].resize((image_size, image_size)), (0, 0))
-    grid_image.paste(images[1].resize((image_size, image_size)), (image_size, 0))
-    grid_image.paste(images[2].resize((image_size, image_size)), (0, image_size))
-    grid_image.paste(images[3].resize((image_size, image_size)), (image_size, image_size))
-    
-    return grid_image
+@st.cache_resource(max_entries=64, show_spinner=False)
+def get_parent_image(digest, _upload):
+    """Prepara a foto de um dos pais uma única vez por conteúdo (hash), para todas as fases e variações."""
+    from conditioning import prepare_parent
+    return prepare_parent(_upload.getvalue())
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_init_image(digest_1, digest_2, _upload_1, _upload_2):
+    """Mistura as fotos preparadas dos pais na imagem inicial (base64), uma única vez por par de fotos."""
+    from conditioning import blend_parents
+    return blend_parents(get_parent_image(digest_1, _upload_1), get_parent_image(digest_2, _upload_2))
+
+@st.cache_data(max_entries=16, ttl=IMAGE_STORE_TTL, show_spinner=False)
+def get_display_image(handle, _stored):
+    """Bytes exibidos de uma entrada do ImageStore, preparados uma única vez por handle (as entradas não mudam)."""
+    return display_bytes(*_stored)
+
+def submit_job(kind, job, caption, total=1):
+    """Enfileira o job da sessão e executa o script de novo; resultados que vêm do cache já aparecem na próxima execução."""
+    job_id = get_job_manager().submit(st.session_state.session_id, kind, job.run, caption=caption, total=total, admit=job.admit)
+    st.session_state.job_id = job_id
+    get_job_manager().wait(job_id, timeout=0.5)
+    st.rerun()
+
+def show_api_error(error):
+    """Exibe na interface as mensagens correspondentes ao erro de API registrado no job."""
+    if error["status_code"] is None:
+        st.error(f"Erro na API: {error['message']}")
+        return
+    st.error(f"Erro na API: {error['message']} (Status: {error['status_code']})")
+    if "must be provided" in error["message"]:
+        st.error("Verifique se sua Chave de API está correta e foi inserida na barra lateral.")
+    if error["status_code"] == 403:
+        st.error("Erro 403: Verifique se você aceitou os termos de uso do modelo no site da Hugging Face.")
+
+def show_job_progress(job_id):
+    """Mostra o andamento de um job pendente; quando ele termina, executa o script de novo para exibir o resultado."""
+    job = get_job_manager().get(job_id)
+    if job is None or job["status"] in FINISHED_STATES:
+        st.rerun()
+    if job["status"] == JOB_QUEUED and job["position"] is not None:
+        st.info(f"🕒 Você está na fila: posição {job['position'] + 1}, espera estimada de ~{job['eta']:.0f}s.")
+    elif job["status"] == JOB_QUEUED:
+        st.info("🕒 Na fila de geração... ⏳")
+    elif job["kind"] in ("grid", "variations"):
+        # Cada fase (ou variação) aparece no seu bloco assim que fica pronta, enquanto as demais continuam em geração
+        if job["kind"] == "grid":
+            labels, per_row = list(PHASES), 2
+            st.progress(job["done"] / job["total"], text=f"Gerando a progressão de idade... {job['done']}/{job['total']} fases concluídas")
+        else:
+            labels, per_row = variation_labels(job["total"]), 4
+            st.progress(job["done"] / job["total"], text=f"Gerando as variações... {job['done']}/{job['total']} concluídas")
+        partials = get_job_manager().partials(job_id)
+        for row_start in range(0, len(labels), per_row):
+            for column, label in zip(st.columns(per_row), labels[row_start:row_start + per_row]):
+                if label in partials:
+                    column.image(partials[label], caption=label, use_column_width=True)
+                else:
+                    column.info(f"⏳ Gerando: {label}...")
+    else:
+        st.info("Gerando sua imagem... ⏳")
+    if job["message"]:
+        st.caption(job["message"])
 
 # --- Interface do Usuário (UI) ---
 
+# Para que gerações e jobs sobrevivam a um recarregamento, a URL leva um token de retomada (nunca o id da sessão).
+# Cada token vale para um único carregamento e é trocado logo em seguida: um link copiado deixa de valer quando
+# a página é recarregada, mas até lá dá acesso às imagens da sessão.
+if 'session_id' not in st.session_state:
+    resume_store = get_resume_store()
+    st.session_state.session_id = resume_session(resume_store, st.query_params.get("retomar", "")) or uuid.uuid4().hex
+    st.query_params["retomar"] = issue_resume_token(resume_store, st.session_state.session_id)
+
+get_metrics_server()
+get_gallery_refresher()
+
 st.title("👶 AI Baby Generator")
 st.markdown("Crie imagens realistas do seu futuro filho(a) em diferentes fases da vida. Siga os passos abaixo.")
 
@@ -75,64 +217,102 @@ with st.sidebar:
     api_key = st.text_input("Chave da API Hugging Face", type="password", help="Sua chave de API é necessária para gerar as imagens.")
     st.markdown("[Obtenha sua chave de API aqui](https://huggingface.co/settings/tokens)")
     
-    if api_key:
-        HEADERS = {"Authorization": f"Bearer {api_key}"}
-    else:
-        HEADERS = None
-
     st.markdown("---")
     
     st.header("🎨 Personalize a Geração")
     
     gender_input = st.radio(
         "Gênero:", 
-        ('Menino', 'Menina', 'Aleatório'), 
+        GENDER_OPTIONS, 
         horizontal=True, 
         index=2
     )
     
-    skin_tone_options = {
-        'Automático': 'beautiful diverse heritage',
-        'Muito Claro': 'very light, pale caucasian skin',
-        'Claro': 'light, fair caucasian skin',
-        'Moreno Claro': 'light brown, mediterranean skin',
-        'Moreno Escuro': 'dark brown, south asian skin',
-        'Negro': 'deep dark, african skin'
-    }
-    skin_tone_selection = st.selectbox("Tom de Pele:", options=list(skin_tone_options.keys()))
+    skin_tone_selection = st.selectbox("Tom de Pele:", options=SKIN_TONE_OPTIONS)
+    
+    use_parent_photos = st.checkbox("Usar as fotos dos pais", help="Envia ao modelo (image-to-image) uma mistura das duas fotos como ponto de partida, em vez de gerar só a partir do texto.")
+    # O backend (e, com ele, requests e Pillow) só é criado quando uma geração começa
+    get_generation_backend = get_conditioning_backend if use_parent_photos else get_backend
+    
+    if api_key:
+        HEADERS = {"Authorization": f"Bearer {api_key}"}
+    elif not requires_api_key(conditioning=use_parent_photos):
+        HEADERS = {}
+    else:
+        HEADERS = None
     
     st.markdown("---")
     
     st.subheader("🖼️ Imagem Única")
-    age_selection = st.selectbox("Selecione a Idade:", options=['Bebê', 'Criança', 'Adolescente'])
+    age_selection = st.selectbox("Selecione a Idade:", options=AGE_OPTIONS)
+    
+    variation_count = st.slider("Número de variações:", 2, MAX_VARIATIONS, min(4, MAX_VARIATIONS), help="Quantas opções o botão 'Gerar Variações' cria de uma vez, cada uma com sua própria semente.")
+    
+    fresh_variation = st.checkbox("Gerar nova variação", help="Ignora o cache e usa uma nova semente aleatória, produzindo uma imagem diferente para as mesmas opções.")
+    
+    preview_mode = st.checkbox("Pré-visualização rápida", value=PREVIEW_DEFAULT, help="Mostra primeiro um rascunho (poucos passos, resolução menor, mesma semente). A versão final só é gerada para os resultados que você decidir manter.")
     
     st.info("Clique nos botões na página principal para gerar a imagem.")
     
     st.markdown("---")
     st.sidebar.info("Este aplicativo usa IA para gerar imagens. Os resultados são artísticos e não uma previsão científica.")
+    cache_stats = get_result_cache().stats()
+    st.caption(f"Cache de resultados: {cache_stats['hits']} acertos / {cache_stats['misses']} falhas ({cache_stats['entries']} imagens, {cache_stats['bytes'] / (1024 * 1024):.1f} MB)")
+    flight_stats = get_single_flight().stats()
+    st.caption(f"Requisições à API: {flight_stats['executed']} enviadas / {flight_stats['coalesced'] + flight_stats['coalesced_remote']} agrupadas com pedidos idênticos em andamento")
+    queue_stats = get_scheduler().stats()
+    st.caption(f"Fila de geração: {queue_stats['queued']} aguardando / {queue_stats['admitted']} liberados")
+    store_stats = get_image_store().stats()
+    st.caption(f"Imagens das sessões: {store_stats['entries']} ({store_stats['memory_bytes'] / (1024 * 1024):.1f} MB em memória)")
+    if ENDPOINTS:
+        pool_stats = get_backend().stats()
+        for endpoint in pool_stats["endpoints"]:
+            latency = f"{endpoint['ewma_ms']:.0f} ms (p95 {endpoint['p95_ms']:.0f} ms)" if endpoint["ewma_ms"] is not None else "sem medições"
+            st.caption(f"Endpoint {endpoint['name']} [{endpoint['state']}]: {latency}, {endpoint['errors']}/{endpoint['requests']} erros")
+        st.caption(f"Pedidos redundantes (hedge): {pool_stats['hedges']}")
+    stage_summary = METRICS.stage_summary()
+    if stage_summary:
+        st.caption("Tempo médio por etapa: " + ", ".join(f"{stage} {mean_ms:.0f} ms" for stage, (_, mean_ms) in stage_summary.items()))
+    gallery_refresher = get_gallery_refresher()
+    if gallery_refresher is not None and gallery_refresher.last_result:
+        gallery_result = gallery_refresher.last_result
+        st.caption(f"Galeria pré-gerada: {gallery_result['cached'] + gallery_result['generated']}/{gallery_result['total']} imagens (atualizada às {time.strftime('%H:%M', time.localtime(gallery_refresher.last_run))})")
+    # Preenchido no fim da página, quando o tempo desta execução já é conhecido
+    run_time_caption = st.empty()
 
 
 # --- PASSO 1: UPLOAD DE FOTOS (SIMULADO) ---
 st.subheader("1. Carregue as Fotos dos Pais")
-st.info("ℹ️ **Atenção:** O upload das fotos é necessário para habilitar a geração. **O modelo de IA não usa as fotos para gerar o resultado.**")
+if use_parent_photos:
+    st.info("ℹ️ As fotos são recortadas, misturadas e enviadas ao modelo como ponto de partida de cada geração.")
+else:
+    st.info("ℹ️ **Atenção:** O upload das fotos é necessário para habilitar a geração. **Sem a opção 'Usar as fotos dos pais', o modelo de IA não usa as fotos para gerar o resultado.**")
 
 col1, col2 = st.columns(2)
 with col1:
     uploaded_file_1 = st.file_uploader("Pai 1 / Mãe 1", type=['jpg', 'jpeg', 'png'], label_visibility="collapsed")
-    if uploaded_file_1:
-        st.image(uploaded_file_1, caption='Pai 1 / Mãe 1', use_column_width=True)
+    upload_1_digest = show_upload(uploaded_file_1, 'Pai 1 / Mãe 1') if uploaded_file_1 is not None else None
 
 with col2:
     uploaded_file_2 = st.file_uploader("Pai 2 / Mãe 2", type=['jpg', 'jpeg', 'png'], label_visibility="collapsed")
-    if uploaded_file_2:
-        st.image(uploaded_file_2, caption='Pai 2 / Mãe 2', use_column_width=True)
+    upload_2_digest = show_upload(uploaded_file_2, 'Pai 2 / Mãe 2') if uploaded_file_2 is not None else None
 
 st.markdown("---")
 
 api_key_provided = HEADERS is not None
-both_images_uploaded = uploaded_file_1 is not None and uploaded_file_2 is not None
+both_images_uploaded = upload_1_digest is not None and upload_2_digest is not None
 ready_to_generate = api_key_provided and both_images_uploaded
 
+# Mistura das fotos dos pais: calculada uma vez por par de fotos e reaproveitada em todas as fases e variações
+init_image = None
+if use_parent_photos and both_images_uploaded:
+    from uploads import UploadError
+    try:
+        init_image = get_init_image(upload_1_digest, upload_2_digest, uploaded_file_1, uploaded_file_2)
+    except UploadError as error:
+        st.error(f"⚠️ {error}")
+        ready_to_generate = False
+
 # --- PASSO 2: GERAÇÃO ---
 st.subheader("2. Gere a Imagem")
 
@@ -141,91 +321,184 @@ if not api_key_provided:
 if not both_images_uploaded:
     st.warning("⚠️ Por favor, carregue as fotos do 'Pai 1 / Mãe 1' e 'Pai 2 / Mãe 2' para habilitar os botões de geração.")
 
-gen_col1, gen_col2 = st.columns(2)
+job_manager = get_job_manager()
+current_job = job_manager.get(st.session_state.job_id) or job_manager.latest(st.session_state.session_id)
+job_pending = current_job is not None and current_job["status"] not in FINISHED_STATES
+
+gen_col1, gen_col2, gen_col3 = st.columns(3)
 result_placeholder = st.empty()
 
-# Lógica dos botões
+# Lógica dos botões: cada geração vira um job em segundo plano, que continua mesmo se o script for executado de novo
 with gen_col1:
-    if st.button("Gerar Imagem Única", use_container_width=True, disabled=not ready_to_generate):
-        with st.spinner("Gerando sua imagem... ⏳"):
-            gender = gender_input if gender_input != 'Aleatório' else random.choice(['Menino', 'Menina'])
-            skin_tone = skin_tone_options[skin_tone_selection]
-            
-            # O código aqui continua funcionando, mas agora usa o novo prompt para 'Bebê'
-            age_desc = AGE_PROMPTS[age_selection].replace('newborn baby', f'newborn {gender.lower()} baby').replace('child', f'{gender.lower()} child').replace('teenager', f'{gender.lower()} teenager')
-            final_prompt = BASE_PROMPT_TEMPLATE.format(age_desc=age_desc, skin_tone=skin_tone)
-            
-            payload = {"inputs": final_prompt, "parameters": {"negative_prompt": NEGATIVE_PROMPT}}
-            image_bytes = query_api(payload, HEADERS)
-            
-            if image_bytes:
-                image = Image.open(io.BytesIO(image_bytes))
-                caption = f"Resultado: {gender} - {age_selection}"
-                result_placeholder.image(image, caption=caption, use_column_width=True)
-                
-                file_name = f"resultado_{gender.lower()}_{age_selection.lower().replace('ê', 'e')}.png"
-                st.session_state.last_image_info = {"bytes": image_bytes, "name": file_name}
+    if st.button("Gerar Imagem Única", use_container_width=True, disabled=not ready_to_generate or job_pending):
+        generation_backend = get_generation_backend()
+        gender = resolve_gender(gender_input)
+        with span("prompt_build"):
+            final_prompt = get_prompt(age_selection, gender, skin_tone_selection)
+        seed = choose_seed([final_prompt.text], fresh_variation, init_image, generation_backend, get_result_cache())
+        if seed is None:
+            st.warning("Esta combinação ainda não está na galeria pré-gerada. Tente novamente mais tarde.")
+        else:
+            payload = build_request(final_prompt.text, seed, init_image)
+            caption = f"Resultado: {gender} - {age_selection}"
+            file_name = f"resultado_{gender.lower()}_{age_selection.lower().replace('ê', 'e')}"
+            preview = preview_mode and wants_preview([payload], fresh_variation, generation_backend, get_result_cache())
+            single = single_job(get_services(generation_backend), st.session_state.session_id, api_key, HEADERS, payload, fresh_variation, file_name, caption, preview=preview)
+            submit_job("single", single, caption)
 
 
 with gen_col2:
-    if st.button("Gerar Todas as Fases", use_container_width=True, type="primary", disabled=not ready_to_generate):
-        with st.spinner("Gerando a progressão de idade... Isso pode levar um minuto!"):
-            gender = gender_input if gender_input != 'Aleatório' else random.choice(['Menino', 'Menina'])
-            skin_tone = skin_tone_options[skin_tone_selection]
-            phases_to_generate = ['Bebê', 'Criança', 'Adolescente', 'Adulto']
-            generated_images = []
-
-            progress_bar = st.progress(0, text="Iniciando geração...")
-            
-            for i, phase in enumerate(phases_to_generate):
-                progress_bar.progress((i) / len(phases_to_generate), text=f"Gerando fase: {phase}...")
-                
-                age_desc = AGE_PROMPTS[phase]
-                if gender.lower() == 'menino':
-                    age_desc = age_desc.replace('newborn baby', 'newborn baby boy').replace('child', 'boy').replace('teenager', 'male teenager').replace('adult', 'man')
-                else:
-                    age_desc = age_desc.replace('newborn baby', 'newborn baby girl').replace('child', 'girl').replace('teenager', 'female teenager').replace('adult', 'woman')
-                
-                final_prompt = BASE_PROMPT_TEMPLATE.format(age_desc=age_desc, skin_tone=skin_tone)
-                payload = {"inputs": final_prompt, "parameters": {"negative_prompt": NEGATIVE_PROMPT}}
-                image_bytes = query_api(payload, HEADERS)
-                
-                if image_bytes:
-                    image = Image.open(io.BytesIO(image_bytes))
-                    generated_images.append(image)
-                else:
-                    st.error(f"Falha ao gerar a fase '{phase}'. Abortando.")
-                    st.session_state.last_image_info = None
-                    progress_bar.empty()
-                    break
-            
-            if len(generated_images) == 4:
-                progress_bar.progress(1.0, text="Montando a grade final...")
-                grid_image = create_image_grid(generated_images)
-                caption = f"Progressão de Idade - {gender}"
-                result_placeholder.image(grid_image, caption=caption, use_column_width=True)
-                progress_bar.empty()
-
-                buf = io.BytesIO()
-                grid_image.save(buf, format="PNG")
-                grid_image_bytes = buf.getvalue()
-                file_name = f"progressao_idade_{gender.lower()}.png"
-                st.session_state.last_image_info = {"bytes": grid_image_bytes, "name": file_name}
+    if st.button("Gerar Todas as Fases", use_container_width=True, type="primary", disabled=not ready_to_generate or job_pending):
+        generation_backend = get_generation_backend()
+        gender = resolve_gender(gender_input)
+        phases_to_generate = list(PHASES)
+        with span("prompt_build"):
+            prompt_texts = [get_prompt(phase, gender, skin_tone_selection).text for phase in phases_to_generate]
+        seed = choose_seed(prompt_texts, fresh_variation, init_image, generation_backend, get_result_cache())
+        if seed is None:
+            st.warning("Esta combinação ainda não está na galeria pré-gerada. Tente novamente mais tarde.")
+        else:
+            payloads = {phase: build_request(text, seed, init_image) for phase, text in zip(phases_to_generate, prompt_texts)}
+            caption = f"Progressão de Idade - {gender}"
+            file_name = f"progressao_idade_{gender.lower()}"
+            preview = preview_mode and wants_preview(list(payloads.values()), fresh_variation, generation_backend, get_result_cache())
+            grid = grid_job(get_services(generation_backend), st.session_state.session_id, api_key, HEADERS, payloads, fresh_variation, file_name, caption, preview=preview)
+            submit_job("grid", grid, caption, total=len(phases_to_generate))
+
+with gen_col3:
+    if st.button("Gerar Variações", use_container_width=True, disabled=not ready_to_generate or job_pending):
+        from generation import variation_seeds, with_seed
+        generation_backend = get_generation_backend()
+        gender = resolve_gender(gender_input)
+        with span("prompt_build"):
+            payload = build_request(get_prompt(age_selection, gender, skin_tone_selection).text, None, init_image)
+        # Sementes explícitas: as mesmas opções repetem as mesmas imagens (e o cache); uma nova variação sorteia outra sequência
+        seeds = variation_seeds(variation_count, random.randint(0, 2**32 - 1) if fresh_variation else 0)
+        caption = f"Variações: {gender} - {age_selection}"
+        file_name = f"variacao_{gender.lower()}_{age_selection.lower().replace('ê', 'e')}"
+        preview = preview_mode and wants_preview([with_seed(payload, seed) for seed in seeds], fresh_variation, generation_backend, get_result_cache())
+        variations = variations_job(get_services(generation_backend), st.session_state.session_id, api_key, HEADERS, payload, seeds, fresh_variation, file_name, caption, preview=preview)
+        submit_job("variations", variations, caption, total=len(seeds))
+
+# Andamento e resultado do job atual da sessão (também após recarregar a página)
+if job_pending:
+    st.session_state.job_id = current_job["id"]
+    with result_placeholder.container():
+        if poll_fragment:
+            poll_fragment(run_every=JOB_POLL_INTERVAL)(show_job_progress)(current_job["id"])
+        else:
+            show_job_progress(current_job["id"])
+elif current_job is not None and current_job["status"] == JOB_DONE:
+    stored = get_image_store().get(current_job["result"])
+    if stored and current_job["kind"] == "variations":
+        result_placeholder.success(f"✅ {current_job['caption']} prontas! Escolha a sua favorita abaixo para salvar.")
+    elif stored:
+        result_caption = f"{current_job['caption']} (rascunho)" if stored[1].get("preview") else current_job["caption"]
+        result_placeholder.image(get_display_image(current_job["result"], stored), caption=result_caption, use_column_width=True)
+elif current_job is not None and current_job["status"] == JOB_FAILED:
+    error = current_job["error"]
+    with result_placeholder.container():
+        show_api_error(error)
+        if error["phase"]:
+            st.error(f"Falha ao gerar a fase '{error['phase']}'. Abortando.")
 
 st.markdown("---")
 
 # --- PASSO 3 - SALVAR IMAGEM ---
-if st.session_state.last_image_info:
+image_store = get_image_store()
+history = image_store.history(st.session_state.session_id)
+if history:
     st.subheader("3. Salve sua Criação")
-    image_info = st.session_state.last_image_info
-    st.download_button(
-        label="📥 Salvar Imagem",
-        data=image_info["bytes"],
-        file_name=image_info["name"],
-        mime="image/png",
-        use_container_width=True
+    captions = dict(history)
+    selected_handle = st.selectbox(
+        "Geração:",
+        options=list(captions),
+        format_func=lambda handle: f"{captions[handle]['caption']} ({captions[handle]['created']}{', rascunho' if captions[handle].get('preview') else ''})",
+        help="Suas últimas gerações continuam disponíveis para download sem precisar gerar de novo."
     )
+    stored = image_store.get(selected_handle)
+    source_handle = selected_handle
+    # Nas variações, o usuário escolhe na tira de miniaturas qual imagem completa será salva
+    if stored and stored[1].get("variations"):
+        st.image(get_display_image(selected_handle, stored), caption=captions[selected_handle]["caption"], use_column_width=True)
+        variations = dict((handle, meta) for handle, meta in image_store.children(selected_handle) if "seed" in meta)
+        source_handle = st.radio(
+            "Escolha a variação:",
+            options=list(variations),
+            format_func=lambda handle: f"{variations[handle]['label']} (semente {variations[handle]['seed']})",
+            horizontal=True
+        )
+        stored = image_store.get(source_handle) if source_handle else None
+    # Rascunho: a versão final só é gerada (em segundo plano, como uma nova geração) se o usuário mantiver o resultado
+    if stored and stored[1].get("full"):
+        draft_meta = stored[1]
+        keep_caption = f"{captions[selected_handle]['caption']} - {draft_meta['label']}" if "label" in draft_meta else captions[selected_handle]["caption"]
+        final_payload = draft_meta["full"].get("payload") or next(iter(draft_meta["full"]["payloads"].values()))
+        keep_conditioned = "prompt" in final_payload["parameters"]
+        st.info("Esta imagem é um rascunho rápido. Mantenha-a para gerar a versão em qualidade final.")
+        if st.button("✨ Manter e gerar versão final", use_container_width=True, disabled=job_pending or (requires_api_key(conditioning=keep_conditioned) and not api_key)):
+            keep_backend = get_conditioning_backend() if keep_conditioned else get_backend()
+            keep_headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+            keep_kind, keep_job, keep_total = upgrade_job(get_services(keep_backend), st.session_state.session_id, api_key, keep_headers, draft_meta, keep_caption)
+            submit_job(keep_kind, keep_job, keep_caption, total=keep_total)
+    # Esquece os arquivos de download de gerações que já saíram do histórico
+    st.session_state.download_handles = {key: handle for key, handle in st.session_state.download_handles.items() if key[0] in captions}
+
+if history and stored:
+    from imaging import OUTPUT_FORMAT, OUTPUT_FORMATS, OUTPUT_QUALITY, PNG_COMPRESS_LEVEL
+    stored_bytes, meta = stored
+    format_options = list(OUTPUT_FORMATS)
+    source_format = meta.get("format")
+    default_format = source_format if source_format in OUTPUT_FORMATS else OUTPUT_FORMAT
+
+    format_col, quality_col = st.columns(2)
+    with format_col:
+        output_format = st.selectbox("Formato do arquivo:", options=format_options, index=format_options.index(default_format))
+    passthrough = meta["kind"] == "encoded" and output_format == source_format
+    with quality_col:
+        if passthrough:
+            encode_option = None
+            st.caption("Imagem original, sem recompressão.")
+        elif output_format == "PNG":
+            encode_option = st.slider("Nível de compressão (PNG):", 0, 9, PNG_COMPRESS_LEVEL, help="Níveis maiores geram arquivos menores, mas demoram mais.")
+        else:
+            encode_option = st.slider("Qualidade:", 10, 100, OUTPUT_QUALITY)
+
+    mime, extension = OUTPUT_FORMATS[output_format]
+    download_bytes = None
+    if passthrough:
+        download_bytes = stored_bytes
+    else:
+        download_key = (selected_handle, source_handle, output_format, encode_option)
+        encoded = image_store.get(st.session_state.download_handles.get(download_key, ""))
+        if encoded:
+            download_bytes = encoded[0]
+        elif st.button("Preparar arquivo para download", use_container_width=True):
+            with st.spinner("Preparando o arquivo..."):
+                download_bytes = encode_download(stored_bytes, meta, output_format, encode_option)
+                st.session_state.download_handles[download_key] = image_store.put(st.session_state.session_id, download_bytes, parent=source_handle)
+
+    if download_bytes is not None:
+        st.download_button(
+            label="📥 Salvar Imagem",
+            data=download_bytes,
+            file_name=f"{meta['name']}.{extension}",
+            mime=mime,
+            use_container_width=True
+        )
+elif history:
+    st.info("Esta imagem expirou do servidor. Gere novamente para salvá-la.")
 
 # --- RODAPÉ PERSONALIZADO ---
 st.divider()
-st.markdown("<p style='text-align: center;'>Desenvolvido com ❤️ por Engº Paulo Silva</p>", unsafe_allow_html=True)
\ No newline at end of file
+st.markdown("<p style='text-align: center;'>Desenvolvido com ❤️ por Engº Paulo Silva</p>", unsafe_allow_html=True)
+
+# Tempo desta execução do script (sem a espera abaixo), exibido na barra lateral e exportado em /metrics
+run_seconds = time.perf_counter() - run_started
+METRICS.observe("script_run_seconds", run_seconds, help_text="Duração de cada execução completa do script da página.")
+run_time_caption.caption(f"Última execução da página: {run_seconds * 1000:.0f} ms")
+
+# Sem suporte a fragmentos, a página inteira é atualizada periodicamente enquanto houver um job pendente
+if job_pending and not poll_fragment:
+    time.sleep(JOB_POLL_INTERVAL)
+    st.rerun()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import base64
+import os
+
+from PIL import Image, ImageOps
+
+from imaging import RESAMPLE_FILTERS, encode_image
+from metrics import span
+from uploads import inspect_upload
+
+# Lado (px) das fotos dos pais preparadas e da imagem inicial enviada ao backend image-to-image
+CONDITIONING_SIZE = int(os.environ.get("AIBABY_CONDITIONING_SIZE", "512"))
+
+# Quanto o backend pode se afastar da imagem inicial (0 = mantém a mistura dos pais, 1 = ignora)
+CONDITIONING_STRENGTH = float(os.environ.get("AIBABY_CONDITIONING_STRENGTH", "0.8"))
+
+
+def prepare_parent(data, size=CONDITIONING_SIZE):
+    """Prepara a foto de um dos pais: recorte quadrado central em RGB com `size` px, decodificado já reduzido."""
+    with span("conditioning_prepare"):
+        image = inspect_upload(data)
+        if image.format == "JPEG":
+            image.draft("RGB", (size, size))
+        # Fotos de celular vêm deitadas com a rotação indicada só no EXIF
+        image = ImageOps.exif_transpose(image)
+        return ImageOps.fit(image.convert("RGB"), (size, size), method=RESAMPLE_FILTERS["lanczos"])
+
+
+def blend_parents(parent_1, parent_2, weight=0.5):
+    """Mistura as duas fotos preparadas na imagem inicial da geração e retorna seus bytes JPEG em base64."""
+    with span("conditioning_blend"):
+        blended = Image.blend(parent_1, parent_2, weight)
+        return base64.b64encode(encode_image(blended, "JPEG", quality=90)).decode("ascii")
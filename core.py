@@ -0,0 +1,449 @@
+"""Núcleo do app, importável sem o Streamlit: configuração, criação dos serviços compartilhados e jobs de geração.
+
+O script da interface só monta a página; tudo o que não depende do Streamlit fica aqui. Os módulos
+pesados (Pillow, requests, diffusers) são importados dentro das funções, no primeiro uso, para que
+a primeira execução da página não pague por eles antes de precisar.
+"""
+import logging
+import os
+import random
+import secrets
+import time
+from collections import namedtuple
+
+from prompts import SKIN_TONES
+
+logger = logging.getLogger(__name__)
+
+# Backend de inferência: 'hf' (API da Hugging Face), 'stub' (servidor local stub_server.py) ou 'diffusers' (local)
+INFERENCE_BACKEND = os.environ.get("AIBABY_BACKEND", "hf")
+
+# URL da API; quando vazia, usa a URL padrão do backend (Stable Diffusion XL na Hugging Face)
+API_URL = os.environ.get("AIBABY_API_URL") or None
+
+# Modelo carregado pelo backend local 'diffusers'; quando vazio, usa o padrão de backends.DIFFUSERS_MODEL_ID
+DIFFUSERS_MODEL = os.environ.get("AIBABY_DIFFUSERS_MODEL") or None
+
+# Modo com as fotos dos pais: backend image-to-image ('hf', 'stub', 'diffusers' ou 'blend', substituto local na CPU) e URL do modelo
+# (vazia: o modelo image-to-image padrão da Hugging Face, ou a URL padrão dos demais backends)
+CONDITIONING_BACKEND = os.environ.get("AIBABY_CONDITIONING_BACKEND", "hf")
+CONDITIONING_URL = os.environ.get("AIBABY_CONDITIONING_URL") or None
+
+# Pool opcional de endpoints equivalentes ('backend=url,backend=url'); quando definido, substitui AIBABY_BACKEND/AIBABY_API_URL
+ENDPOINTS = os.environ.get("AIBABY_ENDPOINTS", "")
+
+# Backends que exigem a chave de API (os que têm `requires_api_key` em backends.py), para decidir sem criá-los
+API_KEY_BACKENDS = ("hf",)
+
+# Configuração do cliente HTTP compartilhado (pool de conexões, keep-alive e timeout de conexão em segundos)
+HTTP_POOL_SIZE = int(os.environ.get("AIBABY_HTTP_POOL_SIZE", "16"))
+HTTP_KEEP_ALIVE = os.environ.get("AIBABY_HTTP_KEEP_ALIVE", "1") != "0"
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("AIBABY_HTTP_CONNECT_TIMEOUT", "5"))
+
+# Cache de resultados: limite da camada em memória (MB) e diretório opcional da camada em disco
+RESULT_CACHE_MAX_MB = int(os.environ.get("AIBABY_CACHE_MAX_MB", "256"))
+RESULT_CACHE_DIR = os.environ.get("AIBABY_CACHE_DIR", "")
+
+# Limites de requisições ao backend (por minuto) e rajada máxima: global, por sessão e por chave de API
+RATE_GLOBAL_PER_MIN = float(os.environ.get("AIBABY_RATE_GLOBAL_PER_MIN", "60"))
+RATE_GLOBAL_BURST = float(os.environ.get("AIBABY_RATE_GLOBAL_BURST", "8"))
+RATE_SESSION_PER_MIN = float(os.environ.get("AIBABY_RATE_SESSION_PER_MIN", "12"))
+RATE_SESSION_BURST = float(os.environ.get("AIBABY_RATE_SESSION_BURST", "4"))
+RATE_API_KEY_PER_MIN = float(os.environ.get("AIBABY_RATE_API_KEY_PER_MIN", "30"))
+RATE_API_KEY_BURST = float(os.environ.get("AIBABY_RATE_API_KEY_BURST", "8"))
+QUEUE_TIMEOUT = float(os.environ.get("AIBABY_QUEUE_TIMEOUT", "300"))
+
+# Banco SQLite do estado compartilhado entre réplicas do app (cache, pedidos em andamento, limites,
+# imagens e, sem AIBABY_JOB_DB, também os jobs); vazio mantém tudo na memória do processo
+SHARED_DB_PATH = os.environ.get("AIBABY_SHARED_DB", "")
+
+# Limite (MB) dos dados guardados no estado compartilhado por todas as réplicas somadas; as entradas mais antigas saem primeiro
+SHARED_MAX_MB = int(os.environ.get("AIBABY_SHARED_MAX_MB", "1024"))
+
+# Jobs de geração em segundo plano: número de workers, banco SQLite opcional e intervalo de atualização da tela (s)
+JOB_WORKERS = int(os.environ.get("AIBABY_JOB_WORKERS", "8"))
+JOB_DB_PATH = os.environ.get("AIBABY_JOB_DB", "")
+JOB_POLL_INTERVAL = float(os.environ.get("AIBABY_JOB_POLL_INTERVAL", "1"))
+
+# Um job na fila ou em execução sem nenhuma atualização por mais que a espera máxima na fila somada ao prazo das
+# novas tentativas (AIBABY_RETRY_DEADLINE, o mesmo de generation.py) ficou com uma réplica que parou e é dado como falho
+JOB_STALE_AFTER = QUEUE_TIMEOUT + float(os.environ.get("AIBABY_RETRY_DEADLINE", "180"))
+
+# Armazenamento das imagens de cada sessão: orçamento global (MB), expiração sem acesso (s),
+# diretório opcional para onde as imagens excedentes são movidas e tamanho do histórico por sessão
+IMAGE_STORE_MAX_MB = int(os.environ.get("AIBABY_STORE_MAX_MB", "512"))
+IMAGE_STORE_TTL = float(os.environ.get("AIBABY_STORE_TTL", "3600"))
+IMAGE_STORE_SPILL_DIR = os.environ.get("AIBABY_STORE_SPILL_DIR", "")
+HISTORY_SIZE = int(os.environ.get("AIBABY_HISTORY_SIZE", "5"))
+
+# Número máximo de variações geradas de uma vez no modo de variações
+MAX_VARIATIONS = int(os.environ.get("AIBABY_MAX_VARIATIONS", "8"))
+
+# Atualização da galeria pré-gerada (gallery.py) em segundo plano no app: intervalo (h; 0 desativa) e
+# chave de API do servidor, usada também pela CLI da galeria
+GALLERY_REFRESH_HOURS = float(os.environ.get("AIBABY_GALLERY_REFRESH_HOURS", "24"))
+GALLERY_TOKEN = os.environ.get("AIBABY_GALLERY_TOKEN", "")
+
+# Porta do endpoint /metrics (formato Prometheus) lido por um coletor local; 0 desativa
+METRICS_PORT = int(os.environ.get("AIBABY_METRICS_PORT", "0"))
+
+# Endereço em que o endpoint /metrics escuta; o padrão só aceita conexões da própria máquina
+METRICS_HOST = os.environ.get("AIBABY_METRICS_HOST", "127.0.0.1")
+
+# Modo pré-visualização ligado por padrão: primeiro um rascunho rápido, a versão final só para os resultados mantidos
+PREVIEW_DEFAULT = os.environ.get("AIBABY_PREVIEW", "1") != "0"
+
+# Qualidade do JPEG usado para exibir na página as grades, tiras e blocos parciais (o download usa o formato escolhido)
+DISPLAY_QUALITY = int(os.environ.get("AIBABY_DISPLAY_QUALITY", "85"))
+
+# Opções fixas dos controles da barra lateral, montadas uma única vez por processo
+GENDER_OPTIONS = ('Menino', 'Menina', 'Aleatório')
+SKIN_TONE_OPTIONS = tuple(SKIN_TONES)
+AGE_OPTIONS = ('Bebê', 'Criança', 'Adolescente')
+
+# Serviços compartilhados usados pelos jobs de geração
+Services = namedtuple("Services", "backend cache flight scheduler image_store")
+
+# Etapas de um job: `admit(ctx)` espera a vez na fila global sem ocupar um worker; `run(ctx)` gera e retorna o resultado
+Job = namedtuple("Job", "admit run")
+
+
+def create_http_session():
+    """Cria a sessão HTTP com pool de conexões usada por todos os backends."""
+    from backends import build_http_session
+    return build_http_session(HTTP_POOL_SIZE, HTTP_KEEP_ALIVE)
+
+
+def create_inference_backend(session):
+    """Cria o backend de inferência configurado (ou o pool de endpoints, com AIBABY_ENDPOINTS)."""
+    from backends import DIFFUSERS_MODEL_ID, create_backend
+    model_id = DIFFUSERS_MODEL or DIFFUSERS_MODEL_ID
+    if ENDPOINTS:
+        from endpoint_pool import create_pool
+        pool = create_pool(ENDPOINTS, session, HTTP_CONNECT_TIMEOUT, model_id=model_id)
+        pool.start_health_checks()
+        return pool
+    return create_backend(INFERENCE_BACKEND, session, HTTP_CONNECT_TIMEOUT, url=API_URL, model_id=model_id)
+
+
+def requires_api_key(conditioning=False):
+    """Indica se o backend configurado (o image-to-image, com `conditioning`) exige a chave de API, sem criá-lo nem importar requests."""
+    if conditioning:
+        return CONDITIONING_BACKEND in API_KEY_BACKENDS
+    if ENDPOINTS:
+        return any(item.partition("=")[0].strip() in API_KEY_BACKENDS for item in ENDPOINTS.split(",") if item.strip())
+    return INFERENCE_BACKEND in API_KEY_BACKENDS
+
+
+def create_conditioning_backend(session):
+    """Cria o backend image-to-image usado no modo com as fotos dos pais."""
+    from backends import DIFFUSERS_MODEL_ID, HF_IMG2IMG_URL, create_backend
+    url = CONDITIONING_URL or (HF_IMG2IMG_URL if CONDITIONING_BACKEND == "hf" else None)
+    return create_backend(CONDITIONING_BACKEND, session, HTTP_CONNECT_TIMEOUT, url=url, model_id=DIFFUSERS_MODEL or DIFFUSERS_MODEL_ID)
+
+
+def create_shared_store():
+    """Abre o estado compartilhado entre réplicas (AIBABY_SHARED_DB) ou retorna None para manter tudo no processo."""
+    if not SHARED_DB_PATH:
+        return None
+    from shared_store import SQLiteSharedStore
+    return SQLiteSharedStore(SHARED_DB_PATH, max_bytes=SHARED_MAX_MB * 1024 * 1024)
+
+
+def create_resume_store(shared=None):
+    """Onde ficam os tokens de retomada: no estado compartilhado, se houver, para que qualquer réplica retome a sessão."""
+    if shared is not None:
+        return shared
+    from shared_store import MemorySharedStore
+    return MemorySharedStore()
+
+
+def create_result_cache(shared=None):
+    from result_cache import ResultCache
+    return ResultCache(RESULT_CACHE_MAX_MB * 1024 * 1024, directory=RESULT_CACHE_DIR, shared=shared)
+
+
+def create_single_flight(shared=None):
+    from single_flight import SingleFlight
+    return SingleFlight(shared=shared)
+
+
+def create_scheduler(shared=None):
+    from scheduler import FairScheduler
+    return FairScheduler(
+        RATE_GLOBAL_PER_MIN / 60, RATE_GLOBAL_BURST,
+        RATE_SESSION_PER_MIN / 60, RATE_SESSION_BURST,
+        RATE_API_KEY_PER_MIN / 60, RATE_API_KEY_BURST,
+        bucket_store=shared,
+    )
+
+
+def create_image_store(shared=None):
+    from image_store import ImageStore
+    return ImageStore(IMAGE_STORE_MAX_MB * 1024 * 1024, IMAGE_STORE_TTL, history_size=HISTORY_SIZE, spill_dir=IMAGE_STORE_SPILL_DIR, shared=shared)
+
+
+def create_job_manager():
+    from jobs import JobManager, MemoryJobStore, SQLiteJobStore
+    # Com o estado compartilhado, os jobs vão para o mesmo banco, para que qualquer réplica acompanhe o job da sessão
+    job_db = JOB_DB_PATH or SHARED_DB_PATH
+    store = SQLiteJobStore(job_db, ttl=IMAGE_STORE_TTL, stale_after=JOB_STALE_AFTER) if job_db else MemoryJobStore(ttl=IMAGE_STORE_TTL)
+    return JobManager(store, JOB_WORKERS)
+
+
+def start_metrics():
+    """Sobe o endpoint /metrics do processo, se AIBABY_METRICS_PORT estiver definido.
+
+    Se a porta já estiver em uso (ex.: outra réplica com a mesma configuração), o app segue sem o endpoint."""
+    if not METRICS_PORT:
+        return None
+    from metrics import start_metrics_server
+    try:
+        return start_metrics_server(METRICS_PORT, METRICS_HOST)
+    except OSError as error:
+        logger.warning("Endpoint /metrics desativado: não foi possível usar %s:%s (%s)", METRICS_HOST, METRICS_PORT, error)
+        return None
+
+
+def create_gallery_refresher(backend_factory, cache, scheduler):
+    """Inicia a atualização periódica da galeria pré-gerada, quando há uma chave de API do servidor (ou o backend dispensa a chave).
+
+    A configuração é conferida antes de importar a galeria: desativada, nem o backend (`backend_factory()`) é criado."""
+    if GALLERY_REFRESH_HOURS <= 0 or (requires_api_key() and not GALLERY_TOKEN):
+        return None
+    from gallery import GalleryRefresher, gallery_payloads, gallery_seeds
+    from scheduler import PRIORITY_BACKGROUND
+    backend = backend_factory()
+    headers = {"Authorization": f"Bearer {GALLERY_TOKEN}"} if GALLERY_TOKEN else {}
+    refresher = GalleryRefresher(
+        gallery_payloads(gallery_seeds()), headers, backend, cache, GALLERY_REFRESH_HOURS * 3600,
+        before_request=lambda: scheduler.acquire("galeria", GALLERY_TOKEN, PRIORITY_BACKGROUND, timeout=QUEUE_TIMEOUT),
+    )
+    refresher.start()
+    return refresher
+
+
+def resume_session(store, token):
+    """Troca o token de retomada da URL pelo id da sessão (ou None) e o invalida: cada token vale para um único carregamento da página."""
+    record = store.get(f"resume:{token}") if token else None
+    if record is None:
+        return None
+    store.delete(f"resume:{token}")
+    return record[0].decode("ascii")
+
+
+def issue_resume_token(store, session_id):
+    """Cria o token de retomada da sessão que vai para a URL; ele expira junto com as imagens da sessão."""
+    token = secrets.token_urlsafe(24)
+    store.put(f"resume:{token}", session_id.encode("ascii"), IMAGE_STORE_TTL)
+    return token
+
+
+def resolve_gender(gender_input):
+    """Sorteia o gênero quando a opção é 'Aleatório'."""
+    return gender_input if gender_input != 'Aleatório' else random.choice(['Menino', 'Menina'])
+
+
+def choose_seed(prompt_texts, fresh, init_image, backend, cache):
+    """Escolhe a semente da geração: aleatória numa nova variação, fixa com as fotos dos pais ou, no modo texto,
+    uma da galeria pré-gerada que já esteja pronta. Retorna None se a galeria não tiver a combinação e a geração ao vivo estiver desativada."""
+    if fresh:
+        return random.randint(0, 2**32 - 1)
+    if init_image is not None:
+        return 0
+    from gallery import gallery_seeds, pick_seed
+    from generation import build_payload
+    return pick_seed(lambda seed: [build_payload(text, seed) for text in prompt_texts], gallery_seeds(), backend, cache)
+
+
+def build_request(prompt, seed, init_image):
+    """Monta o payload de texto ou, com a mistura das fotos dos pais, o payload image-to-image."""
+    from generation import build_conditioned_payload, build_payload
+    if init_image is None:
+        return build_payload(prompt, seed)
+    return build_conditioned_payload(prompt, init_image, seed)
+
+
+def load_stored_image(data, meta):
+    """Reconstrói a imagem PIL de uma entrada do ImageStore (arquivo codificado ou pixels brutos)."""
+    import io
+
+    from PIL import Image
+    if meta["kind"] == "raw":
+        return Image.frombuffer(meta["mode"], meta["size"], data, "raw", meta["mode"], 0, 1)
+    return Image.open(io.BytesIO(data))
+
+
+def display_bytes(data, meta):
+    """Retorna os bytes exibidos na página: o arquivo original, ou um JPEG dos pixels brutos (grades e tiras)."""
+    if meta["kind"] == "encoded":
+        return data
+    from imaging import encode_image
+    return encode_image(load_stored_image(data, meta), "JPEG", quality=DISPLAY_QUALITY)
+
+
+def encode_download(data, meta, output_format, option):
+    """Codifica a imagem no formato de download; `option` é o nível de compressão (PNG) ou a qualidade."""
+    from imaging import encode_image
+    image = load_stored_image(data, meta)
+    if output_format == "PNG":
+        return encode_image(image, "PNG", compress_level=option)
+    return encode_image(image, output_format, quality=option)
+
+
+def retry_reason(error):
+    """Descreve por que uma nova tentativa será feita."""
+    return "O modelo está sendo carregado" if error.status_code == 503 else "A API está ocupada"
+
+
+def variation_labels(count):
+    """Rótulos exibidos para cada variação, na ordem das sementes."""
+    return [f"Variação {index + 1}" for index in range(count)]
+
+
+def wait_in_queue(ctx, scheduler, session_id, api_key, priority, cost):
+    """Aguarda a vez do job na fila global, publicando a posição e a espera estimada no progresso do job."""
+    if cost:
+        scheduler.acquire(session_id, api_key, priority, cost=cost, on_wait=lambda position, eta: ctx.update(position=position, eta=eta), timeout=QUEUE_TIMEOUT)
+    ctx.update(position=None, eta=None)
+
+
+def report_retries(ctx):
+    """Cria o callback `on_retry` que registra as novas tentativas na mensagem do job."""
+    from generation import RETRY_MAX_ATTEMPTS
+
+    def on_retry(error, delay, attempt):
+        ctx.update(message=f"{retry_reason(error)}. Nova tentativa ({attempt + 1}/{RETRY_MAX_ATTEMPTS}) em {delay:.0f}s...")
+    return on_retry
+
+
+def preview_meta(preview, **full):
+    """Metadados de um rascunho: o pedido da versão final (`payload` ou `payloads`), usado por `upgrade_job`."""
+    return {"preview": True, "full": full} if preview else {}
+
+
+def wants_preview(payloads, fresh, backend, cache):
+    """Indica se vale gerar primeiro o rascunho: não quando as versões finais já estão no cache (ex.: galeria pré-gerada)."""
+    from generation import count_uncached
+    return count_uncached(payloads, backend, cache, fresh) > 0
+
+
+def single_job(services, session_id, api_key, headers, payload, fresh, file_name, caption, preview=False):
+    """Cria o job que gera uma imagem e a guarda no ImageStore, retornando o handle.
+
+    Com `preview=True`, gera só o rascunho (ver `generation.preview_payload`)."""
+    from generation import preview_payload
+    request = preview_payload(payload) if preview else payload
+
+    def admit_single(ctx):
+        from generation import count_uncached
+        from scheduler import PRIORITY_SINGLE
+        wait_in_queue(ctx, services.scheduler, session_id, api_key, PRIORITY_SINGLE, count_uncached([request], services.backend, services.cache, fresh))
+
+    def run_single(ctx):
+        import io
+
+        from PIL import Image
+
+        from generation import fetch_image
+        image_bytes = fetch_image(request, headers, services.backend, services.cache, fresh, on_retry=report_retries(ctx), flight=services.flight)
+        # Os bytes da API são guardados como vieram: o download no formato original não recodifica a imagem
+        image_format = Image.open(io.BytesIO(image_bytes)).format
+        return services.image_store.put(
+            session_id, image_bytes, kind="encoded", format=image_format, name=file_name, caption=caption, created=time.strftime("%H:%M:%S"),
+            **preview_meta(preview, payload=payload),
+        )
+    return Job(admit_single, run_single)
+
+
+def grid_job(services, session_id, api_key, headers, payloads, fresh, file_name, caption, preview=False):
+    """Cria o job que gera as fases de `payloads` ({fase: payload}) e guarda a grade montada no ImageStore.
+
+    Com `preview=True`, gera só os rascunhos das fases."""
+    from generation import preview_payload
+    phases = list(payloads)
+    requests = {phase: preview_payload(payload) for phase, payload in payloads.items()} if preview else payloads
+
+    def admit_grid(ctx):
+        from generation import count_uncached
+        from scheduler import PRIORITY_GRID
+        wait_in_queue(ctx, services.scheduler, session_id, api_key, PRIORITY_GRID, count_uncached(list(requests.values()), services.backend, services.cache, fresh))
+
+    def run_grid(ctx):
+        import io
+
+        from PIL import Image
+
+        from generation import generate_phases
+        from imaging import IncrementalGrid, encode_image
+        grid = IncrementalGrid(len(phases), columns=2)
+
+        def on_phase_done(phase, image_bytes, done):
+            # O bloco já vai codificado para a página: o script não recodifica a imagem a cada atualização
+            tile = grid.paste(phases.index(phase), Image.open(io.BytesIO(image_bytes)))
+            ctx.add_partial(phase, encode_image(tile, "JPEG", quality=DISPLAY_QUALITY))
+            ctx.update(done=done)
+
+        generate_phases(requests, headers, services.backend, services.cache, on_done=on_phase_done, fresh=fresh, flight=services.flight, keep=False)
+        # A grade é guardada como pixels brutos e só é codificada quando o usuário pede o download
+        grid_image = grid.image
+        return services.image_store.put(
+            session_id, grid_image.tobytes(), kind="raw", mode=grid_image.mode, size=grid_image.size, name=file_name, caption=caption, created=time.strftime("%H:%M:%S"),
+            **preview_meta(preview, payloads=payloads),
+        )
+    return Job(admit_grid, run_grid)
+
+
+def variations_job(services, session_id, api_key, headers, payload, seeds, fresh, file_name, caption, preview=False):
+    """Cria o job que gera uma variação de `payload` por semente e guarda a tira de miniaturas com cada variação completa.
+
+    Com `preview=True`, gera só os rascunhos; cada variação mantida pelo usuário tem sua versão final gerada à parte."""
+    from generation import preview_payload, with_seed
+    labels = variation_labels(len(seeds))
+    request = preview_payload(payload) if preview else payload
+
+    def admit_variations(ctx):
+        from generation import count_uncached
+        from scheduler import PRIORITY_GRID
+        wait_in_queue(ctx, services.scheduler, session_id, api_key, PRIORITY_GRID, count_uncached([with_seed(request, seed) for seed in seeds], services.backend, services.cache, fresh))
+
+    def run_variations(ctx):
+        import io
+
+        from PIL import Image
+
+        from generation import generate_variations
+        from imaging import THUMBNAIL_SIZE, IncrementalGrid, encode_image
+        strip = IncrementalGrid(len(seeds), columns=len(seeds), tile_size=THUMBNAIL_SIZE)
+
+        def on_variation_done(seed, image_bytes, done):
+            index = seeds.index(seed)
+            tile = strip.paste(index, Image.open(io.BytesIO(image_bytes)))
+            ctx.add_partial(labels[index], encode_image(tile, "JPEG", quality=DISPLAY_QUALITY))
+            ctx.update(done=done)
+
+        results = generate_variations(request, seeds, headers, services.backend, services.cache, on_done=on_variation_done, fresh=fresh, flight=services.flight)
+        # O histórico guarda a tira de miniaturas; cada variação completa fica associada a ela até o usuário escolher uma
+        strip_image = strip.image
+        strip_handle = services.image_store.put(
+            session_id, strip_image.tobytes(), kind="raw", mode=strip_image.mode, size=strip_image.size, name=file_name, caption=caption, created=time.strftime("%H:%M:%S"),
+            variations=len(seeds), **({"preview": True} if preview else {}),
+        )
+        for seed, label in zip(seeds, labels):
+            image_format = Image.open(io.BytesIO(results[seed])).format
+            services.image_store.put(
+                session_id, results[seed], parent=strip_handle, kind="encoded", format=image_format, name=f"{file_name}_{seed}", label=label, seed=seed,
+                **preview_meta(preview, payload=with_seed(payload, seed)),
+            )
+        return strip_handle
+    return Job(admit_variations, run_variations)
+
+
+def upgrade_job(services, session_id, api_key, headers, meta, caption):
+    """Cria o job que gera a versão final de um rascunho que o usuário decidiu manter.
+
+    Retorna (tipo do job, `Job`, total de imagens); a versão final entra no histórico como uma nova geração."""
+    full = meta["full"]
+    if "payloads" in full:
+        return "grid", grid_job(services, session_id, api_key, headers, full["payloads"], False, meta["name"], caption), len(full["payloads"])
+    return "single", single_job(services, session_id, api_key, headers, full["payload"], False, meta["name"], caption), 1
@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from backends import DIFFUSERS_MODEL_ID, APIError, InferenceBackend, create_backend
+
+# Disjuntor: falhas transitórias seguidas que tiram um endpoint do pool e tempo (s) até ele receber um pedido de teste
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("AIBABY_CIRCUIT_FAILURES", "3"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("AIBABY_CIRCUIT_RESET", "30"))
+
+# Pedidos redundantes: com latências suficientes, um segundo endpoint é acionado quando o primeiro passa do p95;
+# antes disso, usa o tempo fixo abaixo (s). Use AIBABY_HEDGE=0 para desativar.
+HEDGE_ENABLED = os.environ.get("AIBABY_HEDGE", "1") != "0"
+HEDGE_DEFAULT_DELAY = float(os.environ.get("AIBABY_HEDGE_AFTER", "20"))
+HEDGE_MIN_SAMPLES = 20
+
+# Intervalo (s) entre as verificações de saúde dos endpoints; 0 desativa
+HEALTH_CHECK_INTERVAL = float(os.environ.get("AIBABY_HEALTH_CHECK_INTERVAL", "30"))
+
+# Estados do disjuntor de cada endpoint
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+# Peso da última medição na média móvel exponencial da latência
+_EWMA_ALPHA = 0.3
+
+
+def parse_endpoints(spec):
+    """Converte 'backend=url,backend=url' (ex.: 'hf=https://...,stub=http://...') em uma lista de (backend, url)."""
+    endpoints = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, target = item.partition("=")
+        endpoints.append((name.strip(), target.strip() or None))
+    return endpoints
+
+
+class _Endpoint:
+    def __init__(self, backend):
+        self.backend = backend
+        self.latencies = deque(maxlen=200)
+        self.ewma = None
+        self.requests = 0
+        self.errors = 0
+        self.status_codes = {}
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.opened_at = 0.0
+        self.in_flight = 0
+        self.hedge_wins = 0
+
+    def p95(self):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))] if ordered else None
+
+
+class EndpointPool(InferenceBackend):
+    """Backend que distribui as gerações entre vários endpoints equivalentes do mesmo modelo.
+
+    Cada pedido vai ao endpoint disponível com menor latência média (ponderada pelos pedidos
+    em andamento). Falhas transitórias passam imediatamente para o próximo endpoint, e
+    `CIRCUIT_FAILURE_THRESHOLD` falhas seguidas abrem o disjuntor, tirando o endpoint do pool
+    até um pedido de teste (ou a verificação de saúde) dar certo. Se a resposta passar do p95
+    do endpoint, um pedido redundante é enviado ao próximo e vale a primeira resposta."""
+
+    name = "pool"
+
+    def __init__(self, backends, hedge=HEDGE_ENABLED, hedge_delay=HEDGE_DEFAULT_DELAY,
+                 failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT, max_workers=64):
+        if not backends:
+            raise ValueError("O pool precisa de ao menos um endpoint.")
+        self._endpoints = [_Endpoint(backend) for backend in backends]
+        self.requires_api_key = any(backend.requires_api_key for backend in backends)
+        # Os endpoints servem o mesmo modelo: o primeiro identifica o pool nas chaves do cache de resultados
+        self.url = backends[0].url
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aibaby-endpoint")
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    def _trial_due(self, endpoint, now):
+        return endpoint.state == CIRCUIT_OPEN and now - endpoint.opened_at >= self.reset_timeout
+
+    def _available(self, now):
+        # Endpoints com disjuntor fechado, ordenados pela latência; um aberto há `reset_timeout` recebe um pedido de teste.
+        # O endpoint só passa a meio-aberto quando o pedido de teste é de fato enviado (ver `generate`)
+        ranked = []
+        for endpoint in self._endpoints:
+            if self._trial_due(endpoint, now):
+                ranked.append((-1.0, endpoint))
+            elif endpoint.state == CIRCUIT_CLOSED:
+                ranked.append(((endpoint.ewma or 0.0) * (1 + endpoint.in_flight), endpoint))
+        ranked.sort(key=lambda item: item[0])
+        return [endpoint for _, endpoint in ranked]
+
+    def _hedge_after(self, endpoint):
+        with self._lock:
+            p95 = endpoint.p95() if len(endpoint.latencies) >= HEDGE_MIN_SAMPLES else None
+        return p95 if p95 is not None else self.hedge_delay
+
+    def _call(self, endpoint, payload, headers, read_timeout):
+        with self._lock:
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+        started = time.monotonic()
+        if not endpoint.backend.requires_api_key:
+            # A chave do usuário só vai para os endpoints que a exigem, nunca para servidores próprios ou locais
+            headers = {name: value for name, value in headers.items() if name.lower() != "authorization"}
+        try:
+            image_bytes = endpoint.backend.generate(payload, headers, read_timeout)
+        except APIError as error:
+            self._record_failure(endpoint, error)
+            raise
+        finally:
+            with self._lock:
+                endpoint.in_flight -= 1
+        self._record_success(endpoint, time.monotonic() - started)
+        return image_bytes
+
+    def _record_success(self, endpoint, elapsed):
+        with self._lock:
+            endpoint.latencies.append(elapsed)
+            endpoint.ewma = elapsed if endpoint.ewma is None else _EWMA_ALPHA * elapsed + (1 - _EWMA_ALPHA) * endpoint.ewma
+            endpoint.status_codes[200] = endpoint.status_codes.get(200, 0) + 1
+            endpoint.consecutive_failures = 0
+            endpoint.state = CIRCUIT_CLOSED
+
+    def _record_failure(self, endpoint, error):
+        with self._lock:
+            endpoint.errors += 1
+            status = error.status_code if error.status_code is not None else "conexão"
+            endpoint.status_codes[status] = endpoint.status_codes.get(status, 0) + 1
+            # Erros do pedido (chave inválida, termos não aceitos) não dizem nada sobre a saúde do endpoint
+            if not error.retryable:
+                if endpoint.state == CIRCUIT_HALF_OPEN:
+                    endpoint.state = CIRCUIT_CLOSED
+                return
+            endpoint.consecutive_failures += 1
+            if endpoint.state == CIRCUIT_HALF_OPEN or endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.state = CIRCUIT_OPEN
+                endpoint.opened_at = time.monotonic()
+
+    def generate(self, payload, headers, read_timeout):
+        with self._lock:
+            now = time.monotonic()
+            remaining = self._available(now)
+            if not remaining:
+                reopen = min(endpoint.opened_at + self.reset_timeout for endpoint in self._endpoints) - now
+                raise APIError(503, "Nenhum endpoint de inferência disponível no momento.", retry_after=max(0.0, reopen))
+        pending = {}
+        started = time.monotonic()
+        hedged = False
+        last_error = None
+        # Erro definitivo (ex.: 4xx) de um dos pedidos: só é levantado se o outro pedido em andamento também falhar
+        fatal_error = None
+
+        def launch():
+            while remaining:
+                endpoint = remaining.pop(0)
+                with self._lock:
+                    if endpoint.state == CIRCUIT_HALF_OPEN or (endpoint.state == CIRCUIT_OPEN and not self._trial_due(endpoint, time.monotonic())):
+                        # Outro pedido já está testando o endpoint (ou o teste falhou e ele voltou a ficar aberto)
+                        continue
+                    if endpoint.state == CIRCUIT_OPEN:
+                        endpoint.state = CIRCUIT_HALF_OPEN
+                pending[self._executor.submit(self._call, endpoint, payload, headers, read_timeout)] = endpoint
+                return endpoint
+            return None
+
+        if launch() is None:
+            raise APIError(503, "Nenhum endpoint de inferência disponível no momento.", retry_after=self.reset_timeout)
+        primary = next(iter(pending.values()))
+        while pending:
+            timeout = None
+            if self.hedge and not hedged and remaining:
+                timeout = max(0.0, self._hedge_after(primary) - (time.monotonic() - started))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # O primeiro endpoint passou do p95: envia um pedido redundante ao próximo
+                hedged = True
+                with self._lock:
+                    self.hedges += 1
+                launch()
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    image_bytes = future.result()
+                except APIError as error:
+                    if not error.retryable:
+                        fatal_error = fatal_error or error
+                    else:
+                        last_error = error
+                    continue
+                if endpoint is not primary:
+                    with self._lock:
+                        endpoint.hedge_wins += 1
+                return image_bytes
+            if fatal_error is not None and not pending:
+                raise fatal_error
+            # Todos os pedidos em andamento falharam: tenta o próximo endpoint disponível
+            if not pending and remaining:
+                primary, started = launch(), time.monotonic()
+                if primary is None:
+                    break
+        raise last_error
+
+    def check_health(self):
+        """Verifica cada endpoint: os que não respondem são retirados do pool e os que voltaram recebem logo um pedido de teste."""
+        for endpoint in self._endpoints:
+            healthy = endpoint.backend.health_check(timeout=5.0)
+            with self._lock:
+                now = time.monotonic()
+                if not healthy and endpoint.state == CIRCUIT_CLOSED:
+                    endpoint.state = CIRCUIT_OPEN
+                    endpoint.opened_at = now
+                elif healthy and endpoint.state == CIRCUIT_OPEN:
+                    endpoint.opened_at = min(endpoint.opened_at, now - self.reset_timeout)
+                elif endpoint.state == CIRCUIT_HALF_OPEN and endpoint.in_flight == 0:
+                    # Meio-aberto sem pedido de teste em andamento (ex.: o teste terminou com um erro inesperado):
+                    # volta a aberto, pronto para um novo teste se respondeu à verificação
+                    endpoint.state = CIRCUIT_OPEN
+                    endpoint.opened_at = now - self.reset_timeout if healthy else now
+
+    def start_health_checks(self, interval=HEALTH_CHECK_INTERVAL):
+        """Inicia uma thread em segundo plano que chama `check_health` a cada `interval` segundos."""
+        if interval <= 0 or self._health_thread is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=loop, name="aibaby-health-check", daemon=True)
+        self._health_thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        """Retorna latência (média móvel e p95), erros por status e estado do disjuntor de cada endpoint."""
+        with self._lock:
+            return {
+                "hedges": self.hedges,
+                "endpoints": [
+                    {
+                        "name": endpoint.backend.name,
+                        "url": endpoint.backend.url,
+                        "state": endpoint.state,
+                        "requests": endpoint.requests,
+                        "errors": endpoint.errors,
+                        "status_codes": dict(endpoint.status_codes),
+                        "in_flight": endpoint.in_flight,
+                        "ewma_ms": endpoint.ewma * 1000 if endpoint.ewma is not None else None,
+                        "p95_ms": endpoint.p95() * 1000 if endpoint.latencies else None,
+                        "hedge_wins": endpoint.hedge_wins,
+                    }
+                    for endpoint in self._endpoints
+                ],
+            }
+
+
+def create_pool(spec, session=None, connect_timeout=5.0, model_id=None, **options):
+    """Cria um `EndpointPool` a partir da especificação de `parse_endpoints`."""
+    backends = []
+    for name, target in parse_endpoints(spec):
+        if name == "diffusers":
+            backends.append(create_backend(name, model_id=target or model_id or DIFFUSERS_MODEL_ID))
+        else:
+            backends.append(create_backend(name, session, connect_timeout, url=target))
+    return EndpointPool(backends, **options)
@@ -0,0 +1,152 @@
+"""Galeria pré-gerada: imagens com sementes fixas para as 48 combinações de fase × gênero × tom de pele.
+
+As imagens vão para o cache de resultados (use a camada em disco, AIBABY_CACHE_DIR, a mesma
+do app), de onde o app as serve na hora. O aquecimento inicial é feito por esta CLI; o app
+completa periodicamente, em segundo plano, as imagens que faltarem.
+
+Uso:
+    AIBABY_CACHE_DIR=cache python gallery.py --seeds 4 --token hf_...
+    AIBABY_CACHE_DIR=cache python gallery.py --refresh --token hf_...
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from backends import APIError, build_http_session, create_backend
+from core import GALLERY_TOKEN
+from generation import MAX_CONCURRENT_REQUESTS, build_payload, count_uncached, fetch_image, variation_seeds
+from prompts import PROMPTS
+from result_cache import ResultCache, payload_key
+from scheduler import QueueTimeout
+
+logger = logging.getLogger(__name__)
+
+# Número de sementes pré-geradas por combinação (as sementes são 0, 1, 2...)
+GALLERY_SEEDS = int(os.environ.get("AIBABY_GALLERY_SEEDS", "4"))
+
+# Se uma combinação ainda não está na galeria, gera ao vivo (1) ou recusa o pedido (0)
+GALLERY_LIVE_FALLBACK = os.environ.get("AIBABY_GALLERY_LIVE_FALLBACK", "1") != "0"
+
+
+def gallery_seeds(count=GALLERY_SEEDS):
+    """Sementes da galeria; coincidem com as sementes padrão do modo de variações."""
+    return variation_seeds(count, 0)
+
+
+def gallery_payloads(seeds):
+    """Lista os payloads de todas as combinações (fase × gênero × tom de pele) para cada semente."""
+    return [build_payload(prompt.text, seed) for prompt in PROMPTS.values() for seed in seeds]
+
+
+def pick_seed(build, seeds, backend, cache, live_fallback=GALLERY_LIVE_FALLBACK):
+    """Escolhe ao acaso uma semente da galeria cujos payloads (`build(semente)`) já estão todos no cache.
+
+    Sem nenhuma pronta, retorna uma semente qualquer da galeria (ou 0, com a galeria desativada por
+    AIBABY_GALLERY_SEEDS=0) para geração ao vivo ou, com `live_fallback=False`, None."""
+    ready = [seed for seed in seeds if count_uncached(build(seed), backend, cache) == 0]
+    if ready:
+        return random.choice(ready)
+    if not live_fallback:
+        return None
+    # A semente 0 é a primeira das variações: os mesmos pedidos continuam acertando o cache
+    return random.choice(seeds) if seeds else 0
+
+
+def warm_gallery(payloads, headers, backend, cache, fresh=False, max_workers=MAX_CONCURRENT_REQUESTS, before_request=None, on_progress=None):
+    """Gera os payloads que ainda não estão no cache (ou todos, com `fresh=True`) e retorna as contagens.
+
+    `before_request()` é chamado antes de cada geração (ex.: para esperar a vez na fila) e
+    `on_progress(concluidos, total)` após cada payload."""
+    pending = payloads if fresh else [payload for payload in payloads if not cache.contains(payload_key(payload, backend.url))]
+    result = {"total": len(payloads), "cached": len(payloads) - len(pending), "generated": 0, "failed": 0}
+
+    def generate(payload):
+        if before_request:
+            before_request()
+        # Com `fresh`, as imagens novas substituem as da galeria no cache
+        fetch_image(payload, headers, backend, cache, fresh, store=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(generate, payload) for payload in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                future.result()
+                result["generated"] += 1
+            except (APIError, QueueTimeout):
+                result["failed"] += 1
+            if on_progress:
+                on_progress(result["cached"] + done, result["total"])
+    return result
+
+
+class GalleryRefresher:
+    """Completa a galeria em segundo plano a cada `interval` segundos, com prioridade mais baixa na fila."""
+
+    def __init__(self, payloads, headers, backend, cache, interval, before_request=None):
+        self.payloads = payloads
+        self.headers = headers
+        self.backend = backend
+        self.cache = cache
+        self.interval = interval
+        self.before_request = before_request
+        self.last_run = None
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._loop, name="aibaby-gallery", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        # O aquecimento inicial é feito pela CLI: a primeira atualização só acontece após um intervalo
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_result = warm_gallery(self.payloads, self.headers, self.backend, self.cache, before_request=self.before_request)
+            except Exception:
+                # Um erro inesperado (ex.: disco cheio na camada do cache) não encerra a thread: a próxima rodada tenta de novo
+                logger.exception("Falha ao atualizar a galeria pré-gerada")
+                continue
+            self.last_run = time.time()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pré-gera a galeria de imagens com sementes fixas no cache de resultados.")
+    parser.add_argument("--seeds", type=int, default=GALLERY_SEEDS, help="Sementes por combinação de fase, gênero e tom de pele.")
+    parser.add_argument("--backend", default=os.environ.get("AIBABY_BACKEND", "hf"), help="Backend de inferência ('hf', 'stub' ou 'diffusers').")
+    parser.add_argument("--url", default=os.environ.get("AIBABY_API_URL") or None, help="URL do modelo; deve ser a mesma usada pelo app.")
+    parser.add_argument("--cache-dir", default=os.environ.get("AIBABY_CACHE_DIR", ""), help="Diretório da camada em disco do cache de resultados do app.")
+    parser.add_argument("--token", default=GALLERY_TOKEN, help="Chave de API da Hugging Face.")
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENT_REQUESTS, help="Gerações simultâneas.")
+    parser.add_argument("--refresh", action="store_true", help="Gera de novo todas as imagens, mesmo as que já estão no cache.")
+    args = parser.parse_args()
+
+    if not args.cache_dir:
+        parser.error("informe --cache-dir (ou AIBABY_CACHE_DIR): a galeria precisa da camada em disco do cache para chegar ao app.")
+    backend = create_backend(args.backend, build_http_session(max(4, args.workers)), url=args.url)
+    if backend.requires_api_key and not args.token:
+        parser.error("o backend exige uma chave de API: use --token ou AIBABY_GALLERY_TOKEN.")
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    # A galeria fica só no disco: a camada em memória do processo da CLI não serve ao app
+    cache = ResultCache(0, directory=args.cache_dir)
+
+    def on_progress(done, total):
+        print(f"\r{done}/{total} imagens", end="", flush=True)
+
+    payloads = gallery_payloads(gallery_seeds(args.seeds))
+    result = warm_gallery(payloads, headers, backend, cache, fresh=args.refresh, max_workers=args.workers, on_progress=on_progress)
+    print(f"\n{result['generated']} geradas, {result['cached']} já estavam no cache, {result['failed']} falharam.")
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
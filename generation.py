@@ -0,0 +1,192 @@
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from backends import APIError
+from conditioning import CONDITIONING_STRENGTH
+from metrics import increment, span
+from prompts import NEGATIVE_PROMPT
+from result_cache import payload_key
+
+# Número máximo de requisições simultâneas à API ao gerar todas as fases
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("AIBABY_MAX_CONCURRENT_REQUESTS", "4"))
+
+# Tempo limite, em segundos, para receber a resposta do backend em cada tentativa
+HTTP_READ_TIMEOUT = float(os.environ.get("AIBABY_HTTP_READ_TIMEOUT", "120"))
+
+# Política de novas tentativas para erros transitórios (modelo carregando, limite de requisições)
+RETRY_MAX_ATTEMPTS = int(os.environ.get("AIBABY_RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.environ.get("AIBABY_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.environ.get("AIBABY_RETRY_MAX_DELAY", "30"))
+RETRY_DEADLINE = float(os.environ.get("AIBABY_RETRY_DEADLINE", "180"))
+
+# Tempo (s) reservado, dentro do prazo, para a última tentativa quando a API pede uma espera maior que o prazo restante
+RETRY_LAST_ATTEMPT = 30.0
+
+# Pré-visualização rápida: passos de inferência e lado (px) do rascunho enviado antes da versão final
+DRAFT_STEPS = int(os.environ.get("AIBABY_DRAFT_STEPS", "8"))
+DRAFT_SIZE = int(os.environ.get("AIBABY_DRAFT_SIZE", "512"))
+
+
+def retry_delay(error, attempt):
+    """Calcula a espera antes da próxima tentativa: backoff exponencial limitado com jitter, respeitando o tempo indicado pela API."""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    if error.retry_after is not None:
+        delay = max(delay, error.retry_after)
+    return delay
+
+
+def request_with_retry(payload, headers, backend, deadline=RETRY_DEADLINE, on_retry=None, last_attempt=RETRY_LAST_ATTEMPT):
+    """Chama o backend novamente em falhas transitórias até `RETRY_MAX_ATTEMPTS` tentativas ou o prazo total `deadline` (segundos).
+
+    Se a espera pedida pela API (ex.: o `estimated_time` de um modelo carregando) passar do prazo, espera
+    o quanto ainda cabe, deixando `last_attempt` segundos livres, e faz uma última tentativa.
+    `on_retry(erro, espera, tentativa)` é chamado antes de cada nova tentativa."""
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        remaining = deadline - (time.monotonic() - started)
+        try:
+            return backend.generate(payload, headers, read_timeout=max(1.0, min(HTTP_READ_TIMEOUT, remaining)))
+        except APIError as error:
+            attempt += 1
+            if not error.retryable or attempt >= RETRY_MAX_ATTEMPTS:
+                raise
+            delay = retry_delay(error, attempt)
+            remaining = deadline - (time.monotonic() - started)
+            if delay >= remaining:
+                delay = remaining - last_attempt
+                if delay < 0:
+                    raise
+            increment("retries_total", help_text="Novas tentativas após falhas transitórias do backend.", status=error.status_code or "conexão")
+            if on_retry:
+                on_retry(error, delay, attempt)
+            time.sleep(delay)
+
+
+def fetch_image(payload, headers, backend, cache, fresh=False, on_retry=None, flight=None, store=None):
+    """Retorna a imagem do cache de resultados ou a gera pela API e a armazena no cache.
+
+    Com `fresh=True` (nova variação) a leitura do cache é ignorada, inclusive o cache da
+    própria Hugging Face, e o resultado não é armazenado: a semente aleatória não volta a ser
+    pedida. `store=True` armazena mesmo assim (ex.: ao gerar de novo a galeria). Com um
+    `SingleFlight`, pedidos idênticos simultâneos (de qualquer sessão) compartilham uma única requisição."""
+    if store is None:
+        store = not fresh
+    key = payload_key(payload, backend.url)
+    if fresh:
+        headers = {**headers, "x-use-cache": "false"}
+    else:
+        cached = cache.get(key)
+        increment("cache_lookups_total", help_text="Consultas ao cache de resultados.", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return cached
+
+    def generate():
+        # Com o agrupamento entre processos, outra réplica pode ter gerado a imagem enquanto este pedido esperava
+        if not fresh and flight is not None and flight.shared is not None and cache.contains(key):
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        with span("request", backend=backend.name):
+            image_bytes = request_with_retry(payload, headers, backend, on_retry=on_retry)
+        if store:
+            cache.put(key, image_bytes)
+        return image_bytes
+
+    if flight is None:
+        return generate()
+    # Pedidos de sessões diferentes são agrupados: um erro definitivo de quem iniciou (ex.: 401 com uma chave
+    # inválida) pode não valer para quem esperava, que então tenta com as próprias credenciais
+    return flight.do(key, generate, rerun_on=lambda error: isinstance(error, APIError) and not error.retryable)
+
+
+def count_uncached(payloads, backend, cache, fresh=False):
+    """Conta quantos payloads realmente precisarão ir ao backend (os demais já estão no cache)."""
+    if fresh:
+        return len(payloads)
+    return sum(1 for payload in payloads if not cache.contains(payload_key(payload, backend.url)))
+
+
+def generate_phases(payloads, headers, backend, cache, max_workers=MAX_CONCURRENT_REQUESTS, on_done=None, fresh=False, flight=None, keep=True):
+    """Envia os payloads de todas as fases em paralelo e retorna um dicionário {fase: bytes}.
+
+    `on_done(fase, bytes_da_imagem, concluidas)` é chamado na thread que chamou a função
+    sempre que uma fase termina, permitindo exibir cada resultado assim que ele chega.
+    Com `keep=False` os bytes só são entregues a `on_done` e liberados em seguida (o
+    dicionário retornado fica com None), para quem monta a grade à medida que as fases chegam.
+    Falhas transitórias são repetidas individualmente por fase; só quando uma fase esgota
+    suas tentativas as requisições ainda pendentes são canceladas e o APIError é
+    repassado com o atributo `phase` preenchido."""
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        futures = {executor.submit(fetch_image, payload, headers, backend, cache, fresh, None, flight): phase for phase, payload in payloads.items()}
+        for future in as_completed(futures):
+            # O future sai do dicionário para não manter os bytes da fase vivos até o fim da função
+            phase = futures.pop(future)
+            try:
+                image_bytes = future.result()
+            except APIError as error:
+                error.phase = phase
+                for pending in futures:
+                    pending.cancel()
+                raise
+            results[phase] = image_bytes if keep else None
+            if on_done:
+                on_done(phase, image_bytes, len(results))
+            # Nem as variáveis do laço seguram a fase anterior enquanto a próxima é aguardada
+            del future, image_bytes
+    finally:
+        executor.shutdown(wait=False)
+    return results
+
+
+def variation_seeds(count, base_seed=0):
+    """Retorna `count` sementes consecutivas a partir de `base_seed`; as mesmas opções repetem as mesmas sementes (e acertam o cache)."""
+    return [(base_seed + index) % 2**32 for index in range(count)]
+
+
+def with_seed(payload, seed):
+    """Retorna uma cópia do payload com a semente informada."""
+    return {**payload, "parameters": {**payload.get("parameters", {}), "seed": seed}}
+
+
+def preview_payload(payload, steps=DRAFT_STEPS, size=DRAFT_SIZE):
+    """Retorna uma cópia do payload para o rascunho: mesma semente, menos passos e, no text-to-image, resolução menor.
+
+    No image-to-image a resolução vem da foto de entrada e só os passos mudam."""
+    parameters = {**payload.get("parameters", {}), "num_inference_steps": steps}
+    if "prompt" not in parameters:
+        parameters.update(width=size, height=size)
+    return {**payload, "parameters": parameters}
+
+
+def generate_variations(payload, seeds, headers, backend, cache, max_workers=MAX_CONCURRENT_REQUESTS, on_done=None, fresh=False, flight=None):
+    """Gera uma variação do mesmo payload para cada semente, em paralelo, e retorna um dicionário {semente: bytes}.
+
+    `on_done(semente, bytes_da_imagem, concluidas)` segue o mesmo contrato de `generate_phases`."""
+    payloads = {seed: with_seed(payload, seed) for seed in seeds}
+    try:
+        return generate_phases(payloads, headers, backend, cache, max_workers=max_workers, on_done=on_done, fresh=fresh, flight=flight)
+    except APIError as error:
+        error.phase = None
+        raise
+
+
+def build_payload(prompt, seed=None):
+    """Monta o payload enviado à API; a semente, quando informada, torna o resultado reproduzível."""
+    parameters = {"negative_prompt": NEGATIVE_PROMPT}
+    if seed is not None:
+        parameters["seed"] = seed
+    return {"inputs": prompt, "parameters": parameters}
+
+
+def build_conditioned_payload(prompt, init_image, seed=None, strength=CONDITIONING_STRENGTH):
+    """Monta o payload image-to-image: `init_image` (base64) é a mistura das fotos dos pais e o prompt guia a fase."""
+    parameters = {"prompt": prompt, "negative_prompt": NEGATIVE_PROMPT, "strength": strength}
+    if seed is not None:
+        parameters["seed"] = seed
+    return {"inputs": init_image, "parameters": parameters}
+
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+
+class _Entry:
+    __slots__ = ("data", "path", "size", "meta", "session_id", "touched", "children")
+
+    def __init__(self, data, meta, session_id):
+        self.data = data
+        self.path = None
+        self.size = len(data)
+        self.meta = meta
+        self.session_id = session_id
+        self.touched = time.monotonic()
+        self.children = []
+
+
+class ImageStore:
+    """Armazena no servidor os bytes das imagens geradas, com orçamento global de memória.
+
+    A sessão do Streamlit guarda apenas o identificador (handle) devolvido por `put`. As
+    entradas menos usadas são removidas (ou gravadas em disco, se `spill_dir` for
+    informado) quando o orçamento estoura e expiram após `ttl` segundos sem acesso. Cada
+    sessão mantém um histórico das suas últimas `history_size` gerações.
+
+    Com `shared` (ver shared_store.py), cada entrada também é gravada no estado compartilhado,
+    de onde qualquer réplica a lê (e monta o histórico) quando a sessão volta por outro processo;
+    lá ela expira `ttl` segundos após ser guardada."""
+
+    def __init__(self, max_bytes, ttl, history_size=5, spill_dir=None, shared=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.history_size = history_size
+        self.spill_dir = spill_dir or None
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._histories = {}
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.spills = 0
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def put(self, session_id, data, parent=None, **meta):
+        """Guarda os bytes e retorna o handle; `parent` associa um derivado (ex.: arquivo de download) a outra entrada."""
+        handle = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._entries[handle] = _Entry(data, meta, session_id)
+            self._memory_bytes += len(data)
+            if parent is not None and parent in self._entries:
+                self._entries[parent].children.append(handle)
+            elif parent is None:
+                history = self._histories.setdefault(session_id, deque())
+                history.append(handle)
+                while len(history) > self.history_size:
+                    self._discard(history.popleft())
+            self._evict()
+        if self.shared is not None:
+            self.shared.put(f"image:{handle}", data, self.ttl, meta=meta, owner=session_id, parent=f"image:{parent}" if parent is not None else None)
+        return handle
+
+    def get(self, handle):
+        """Retorna (bytes, metadados) da entrada, ou None se ela expirou ou foi removida."""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(handle)
+            if entry is None:
+                return self.shared.get(f"image:{handle}") if self.shared is not None else None
+            entry.touched = time.monotonic()
+            self._entries.move_to_end(handle)
+            if entry.data is not None:
+                return entry.data, entry.meta
+            path = entry.path
+        try:
+            with open(path, "rb") as handle_file:
+                return handle_file.read(), entry.meta
+        except FileNotFoundError:
+            return None
+
+    def history(self, session_id):
+        """Lista (handle, metadados) das gerações ainda disponíveis da sessão, da mais recente para a mais antiga."""
+        if self.shared is not None:
+            return [(key[len("image:"):], meta) for key, meta in self.shared.recent(session_id, self.history_size)]
+        with self._lock:
+            self._expire()
+            handles = self._histories.get(session_id, ())
+            return [(handle, self._entries[handle].meta) for handle in reversed(handles) if handle in self._entries]
+
+    def children(self, handle):
+        """Lista (handle, metadados) das entradas derivadas de `handle` ainda disponíveis, na ordem em que foram guardadas."""
+        if self.shared is not None:
+            return [(key[len("image:"):], meta) for key, meta in self.shared.children(f"image:{handle}")]
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(handle)
+            if entry is None:
+                return []
+            return [(child, self._entries[child].meta) for child in entry.children if child in self._entries]
+
+    def stats(self):
+        """Retorna o uso de memória e os contadores de remoção e gravação em disco."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "sessions": len(self._histories),
+                "evictions": self.evictions,
+                "spills": self.spills,
+            }
+
+    def _discard(self, handle):
+        entry = self._entries.pop(handle, None)
+        if entry is None:
+            return
+        if entry.data is not None:
+            self._memory_bytes -= entry.size
+        if entry.path:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        for child in entry.children:
+            self._discard(child)
+
+    def _expire(self):
+        # As entradas ficam em ordem de último acesso: basta percorrer até a primeira ainda válida
+        deadline = time.monotonic() - self.ttl
+        expired = []
+        for handle, entry in self._entries.items():
+            if entry.touched >= deadline:
+                break
+            expired.append(handle)
+        if not expired:
+            return
+        for handle in expired:
+            self._discard(handle)
+        for session_id in [sid for sid, history in self._histories.items() if not any(h in self._entries for h in history)]:
+            del self._histories[session_id]
+
+    def _evict(self):
+        for handle, entry in list(self._entries.items()):
+            if self._memory_bytes <= self.max_bytes:
+                return
+            if entry.data is None:
+                continue
+            if self.spill_dir:
+                fd, path = tempfile.mkstemp(dir=self.spill_dir, suffix=".img")
+                with os.fdopen(fd, "wb") as spill_file:
+                    spill_file.write(entry.data)
+                entry.path, entry.data = path, None
+                self._memory_bytes -= entry.size
+                self.spills += 1
+            else:
+                self._discard(handle)
+                self.evictions += 1
@@ -0,0 +1,137 @@
+import io
+import math
+import os
+
+from PIL import Image
+
+from metrics import span
+
+# Filtros de reamostragem disponíveis para reduzir as imagens da grade
+_RESAMPLING = getattr(Image, "Resampling", Image)
+RESAMPLE_FILTERS = {
+    "nearest": _RESAMPLING.NEAREST,
+    "box": _RESAMPLING.BOX,
+    "bilinear": _RESAMPLING.BILINEAR,
+    "hamming": _RESAMPLING.HAMMING,
+    "bicubic": _RESAMPLING.BICUBIC,
+    "lanczos": _RESAMPLING.LANCZOS,
+}
+
+# Tamanho (px) de cada bloco da grade e filtro usado quando a redução não é por fator inteiro
+GRID_TILE_SIZE = int(os.environ.get("AIBABY_GRID_TILE_SIZE", "512"))
+GRID_RESAMPLE = os.environ.get("AIBABY_GRID_RESAMPLE", "bicubic")
+
+# Tamanho (px) de cada miniatura das tiras de variações
+THUMBNAIL_SIZE = int(os.environ.get("AIBABY_THUMBNAIL_SIZE", "256"))
+
+# Formatos oferecidos para download: (tipo MIME, extensão do arquivo)
+OUTPUT_FORMATS = {
+    "PNG": ("image/png", "png"),
+    "WEBP": ("image/webp", "webp"),
+    "JPEG": ("image/jpeg", "jpg"),
+}
+
+# Formato padrão do download das grades, qualidade (WebP/JPEG) e nível de compressão do PNG (0-9)
+OUTPUT_FORMAT = os.environ.get("AIBABY_OUTPUT_FORMAT", "PNG").upper()
+OUTPUT_QUALITY = int(os.environ.get("AIBABY_OUTPUT_QUALITY", "90"))
+PNG_COMPRESS_LEVEL = int(os.environ.get("AIBABY_PNG_COMPRESS_LEVEL", "3"))
+
+
+def grid_shape(count, columns=None):
+    """Calcula (linhas, colunas) da grade; sem `columns`, usa a grade quadrada mais próxima (2x2, 3x3...)."""
+    columns = max(1, min(count, columns or math.ceil(math.sqrt(count))))
+    return math.ceil(count / columns), columns
+
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def fit_tile(image, tile_size, resample=None):
+    """Reduz a imagem para um bloco `tile_size` x `tile_size` em RGB (ou RGBA, se tiver transparência).
+
+    JPEGs ainda não carregados são decodificados já em escala reduzida (`draft`), reduções
+    por fator inteiro usam `Image.reduce` e nenhuma cópia é feita se a imagem já está pronta."""
+    resample = RESAMPLE_FILTERS[resample or GRID_RESAMPLE]
+    target = (tile_size, tile_size)
+    if image.format == "JPEG":
+        image.draft("RGB", target)
+    with span("decode", format=image.format or "raw"):
+        image.load()
+    mode = "RGBA" if _has_alpha(image) else "RGB"
+    # `reduce` não aceita imagens com paleta: converte antes de reduzir
+    if image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert(mode)
+    width, height = image.size
+    if (width, height) != target:
+        if width % tile_size == 0 and height % tile_size == 0 and width >= tile_size and height >= tile_size:
+            image = image.reduce((width // tile_size, height // tile_size))
+        else:
+            image = image.resize(target, resample, reducing_gap=2.0)
+    if image.mode != mode:
+        image = image.convert(mode)
+    return image
+
+
+class IncrementalGrid:
+    """Grade montada aos poucos: cada imagem é colada no seu bloco assim que fica pronta."""
+
+    def __init__(self, count, columns=None, tile_size=GRID_TILE_SIZE, resample=None, background=(0, 0, 0)):
+        self.count = count
+        self.rows, self.columns = grid_shape(count, columns)
+        self.tile_size = tile_size
+        self.resample = resample
+        self.image = Image.new('RGB', (self.columns * tile_size, self.rows * tile_size), background)
+        self.filled = set()
+
+    @property
+    def complete(self):
+        return len(self.filled) == self.count
+
+    def paste(self, index, image):
+        """Reduz a imagem, cola no bloco `index` e retorna o bloco reduzido.
+
+        A imagem original é fechada logo após a colagem, liberando a decodificação em tamanho
+        completo: no pico ficam só a imagem atual e a grade."""
+        with span("grid", index=index):
+            tile = fit_tile(image, self.tile_size, self.resample)
+            box = ((index % self.columns) * self.tile_size, (index // self.columns) * self.tile_size)
+            self.image.paste(tile, box, tile if tile.mode == "RGBA" else None)
+        if tile is not image:
+            image.close()
+        self.filled.add(index)
+        return tile
+
+
+def create_image_grid(images, columns=None, tile_size=GRID_TILE_SIZE, resample=None, background=(0, 0, 0)):
+    """Cria uma imagem única a partir de N imagens em uma grade (1xN, 2x2, 3x3...).
+
+    Cada imagem é reduzida e colada na sua posição e pode ser liberada logo em seguida."""
+    images = list(images)
+    grid = IncrementalGrid(len(images), columns, tile_size, resample, background)
+    for index, image in enumerate(images):
+        grid.paste(index, image)
+        images[index] = None
+    return grid.image
+
+
+def write_image_grid(images, fp, format="PNG", columns=None, tile_size=GRID_TILE_SIZE, resample=None, **save_options):
+    """Monta a grade e a codifica diretamente em `fp` (arquivo, socket ou buffer), sem gerar uma cópia intermediária dos bytes."""
+    grid_image = create_image_grid(images, columns, tile_size, resample)
+    grid_image.save(fp, format=format, **save_options)
+    return fp
+
+
+def encode_image(image, format=OUTPUT_FORMAT, quality=OUTPUT_QUALITY, compress_level=PNG_COMPRESS_LEVEL):
+    """Codifica a imagem no formato escolhido e retorna os bytes do arquivo."""
+    if format not in OUTPUT_FORMATS:
+        raise ValueError(f"Formato de saída não suportado: {format!r}")
+    buf = io.BytesIO()
+    with span("encode", format=format):
+        if format == "PNG":
+            image.save(buf, format="PNG", compress_level=compress_level)
+        elif format == "WEBP":
+            image.save(buf, format="WEBP", quality=quality, method=4)
+        else:
+            image.convert("RGB").save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
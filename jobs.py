@@ -0,0 +1,259 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Estados de um job de geração
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+_FIELDS = ("id", "owner", "kind", "caption", "status", "position", "eta", "done", "total", "message", "error", "result", "created", "updated", "worker")
+
+# Processo que executa os jobs criados aqui; várias réplicas podem dividir o mesmo banco
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Erro gravado nos jobs que ficaram sem processo para terminá-los
+_ORPHAN_ERROR = json.dumps({"status_code": None, "message": "A geração foi interrompida pelo reinício do servidor.", "phase": None})
+
+
+def _new_record(owner, kind, caption, total):
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex, "owner": owner, "kind": kind, "caption": caption, "status": JOB_QUEUED,
+        "position": None, "eta": None, "done": 0, "total": total, "message": "", "error": None, "result": None,
+        "created": now, "updated": now, "worker": WORKER_ID,
+    }
+
+
+def _worker_alive(worker):
+    """Indica se o processo que registrou o job ainda roda; processos de outras máquinas são considerados vivos."""
+    if not worker:
+        # Registro anterior à coluna `worker`, de um processo que já terminou
+        return False
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MemoryJobStore:
+    """Guarda os registros dos jobs na memória do processo; jobs finalizados expiram após `ttl` segundos."""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, record):
+        with self._lock:
+            self._expire()
+            self._jobs[record["id"]] = dict(record)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields, updated=time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            record = self._jobs.get(job_id)
+            return dict(record) if record else None
+
+    def latest(self, owner):
+        with self._lock:
+            records = [record for record in self._jobs.values() if record["owner"] == owner]
+            return dict(max(records, key=lambda record: record["created"])) if records else None
+
+    def _expire(self):
+        deadline = time.time() - self.ttl
+        for job_id in [job_id for job_id, record in self._jobs.items() if record["status"] in FINISHED_STATES and record["updated"] < deadline]:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Guarda os registros dos jobs em um banco SQLite (modo WAL), que sobrevive a reinícios do servidor.
+
+    Vários processos podem usar o mesmo banco. Jobs que estavam na fila ou em execução em um
+    processo desta máquina que já terminou são marcados como falhos; os de réplicas ainda vivas
+    (ou de outras máquinas) não são tocados. Com `stale_after`, também falham os jobs sem nenhuma
+    atualização há mais desse tempo (s), de qualquer réplica, ao abrir o banco e ao serem consultados."""
+
+    def __init__(self, path, ttl=3600, stale_after=None):
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, owner TEXT, kind TEXT, caption TEXT, status TEXT, "
+            "position INTEGER, eta REAL, done INTEGER, total INTEGER, message TEXT, error TEXT, result TEXT, created REAL, updated REAL, worker TEXT)"
+        )
+        if "worker" not in [column[1] for column in self._conn.execute("PRAGMA table_info(jobs)")]:
+            try:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN worker TEXT")
+            except sqlite3.OperationalError:
+                # Outra réplica atualizou o banco antigo ao mesmo tempo
+                pass
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created)")
+        self._fail_orphans()
+
+    def _fail_orphans(self):
+        rows = self._conn.execute("SELECT id, worker, updated FROM jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)).fetchall()
+        # Nenhum job deste processo existe antes de o banco ser aberto: o mesmo WORKER_ID é de um processo anterior
+        # que recebeu o mesmo PID (ex.: após reiniciar o contêiner)
+        orphans = [job_id for job_id, worker, updated in rows if worker == WORKER_ID or not _worker_alive(worker) or self._is_stale(updated)]
+        for job_id in orphans:
+            self._conn.execute("UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?", (JOB_FAILED, _ORPHAN_ERROR, time.time(), job_id))
+
+    def _is_stale(self, updated):
+        return self.stale_after is not None and updated < time.time() - self.stale_after
+
+    def _fail_if_stale(self, record):
+        # Chamado com self._lock: um job parado há mais de `stale_after` ficou com uma réplica que deixou de rodar
+        if record is not None and record["status"] in (JOB_QUEUED, JOB_RUNNING) and self._is_stale(record["updated"]):
+            now = time.time()
+            self._conn.execute("UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ? AND updated = ?", (JOB_FAILED, _ORPHAN_ERROR, now, record["id"], record["updated"]))
+            record.update(status=JOB_FAILED, error=json.loads(_ORPHAN_ERROR), updated=now)
+        return record
+
+    def _row_to_record(self, row):
+        if row is None:
+            return None
+        record = dict(zip(_FIELDS, row))
+        record["error"] = json.loads(record["error"]) if record["error"] else None
+        return record
+
+    def create(self, record):
+        values = [json.dumps(record[name]) if name == "error" and record[name] else record[name] for name in _FIELDS]
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?", (*FINISHED_STATES, time.time() - self.ttl))
+            self._conn.execute(f"INSERT INTO jobs ({', '.join(_FIELDS)}) VALUES ({', '.join('?' * len(_FIELDS))})", values)
+
+    def update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        if fields.get("error") is not None:
+            fields["error"] = json.dumps(fields["error"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._fail_if_stale(self._row_to_record(row))
+
+    def latest(self, owner):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(_FIELDS)} FROM jobs WHERE owner = ? ORDER BY created DESC LIMIT 1", (owner,)).fetchone()
+            return self._fail_if_stale(self._row_to_record(row))
+
+
+class JobContext:
+    """Passado à função do job para que ela publique o progresso enquanto roda."""
+
+    def __init__(self, manager, job_id):
+        self._manager = manager
+        self.job_id = job_id
+
+    def update(self, **fields):
+        self._manager.store.update(self.job_id, **fields)
+
+    def add_partial(self, key, value):
+        """Publica um resultado parcial (ex.: o bloco de uma fase da grade) para a interface exibir."""
+        with self._manager._lock:
+            self._manager._partials.setdefault(self.job_id, {})[key] = value
+
+
+class JobManager:
+    """Executa as gerações em segundo plano, fora da thread do script do Streamlit.
+
+    Os registros (estado, progresso, erro e resultado) ficam no `store`; a interface guarda
+    apenas o id do job e consulta o andamento a cada execução do script.
+
+    A espera pela vez na fila global (`admit`) acontece numa thread própria de cada job, fora do
+    pool de `max_workers`: os workers ficam só com jobs já liberados, e a fila justa decide a ordem."""
+
+    def __init__(self, store, max_workers):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="aibaby-job")
+        self._partials = {}
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def submit(self, owner, kind, func, caption="", total=1, admit=None):
+        """Enfileira `func(contexto)` e retorna o id do job; o valor retornado por `func` vira o resultado.
+
+        `admit(contexto)`, se informado, roda antes e bloqueia até o job poder seguir (ex.: a vez na fila global)."""
+        record = _new_record(owner, kind, caption, total)
+        self.store.create(record)
+        with self._lock:
+            self._finished[record["id"]] = threading.Event()
+        if admit is None:
+            self._executor.submit(self._run, record["id"], func)
+        else:
+            threading.Thread(target=self._admit, args=(record["id"], admit, func), name="aibaby-admission", daemon=True).start()
+        return record["id"]
+
+    def wait(self, job_id, timeout):
+        """Espera até `timeout` segundos o job terminar (ex.: para exibir na hora resultados que vêm do cache)."""
+        with self._lock:
+            finished = self._finished.get(job_id)
+        if finished is not None:
+            finished.wait(timeout)
+
+    def get(self, job_id):
+        return self.store.get(job_id) if job_id else None
+
+    def latest(self, owner):
+        return self.store.latest(owner)
+
+    def partials(self, job_id):
+        with self._lock:
+            return dict(self._partials.get(job_id, {}))
+
+    def _admit(self, job_id, admit, func):
+        try:
+            admit(JobContext(self, job_id))
+        except Exception as exc:
+            self._fail(job_id, exc)
+            self._finish(job_id)
+        else:
+            self._executor.submit(self._run, job_id, func)
+
+    def _run(self, job_id, func):
+        context = JobContext(self, job_id)
+        try:
+            self.store.update(job_id, status=JOB_RUNNING)
+            result = func(context)
+        except Exception as exc:
+            self._fail(job_id, exc)
+        else:
+            self.store.update(job_id, status=JOB_DONE, result=result)
+        finally:
+            self._finish(job_id)
+
+    def _fail(self, job_id, exc):
+        error = {"status_code": getattr(exc, "status_code", None), "message": getattr(exc, "message", str(exc)), "phase": getattr(exc, "phase", None)}
+        self.store.update(job_id, status=JOB_FAILED, error=error)
+
+    def _finish(self, job_id):
+        with self._lock:
+            self._partials.pop(job_id, None)
+            finished = self._finished.pop(job_id, None)
+        if finished is not None:
+            finished.set()
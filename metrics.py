@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Arquivo opcional onde cada span é gravado como uma linha JSON no formato de spans do OpenTelemetry
+TRACE_LOG_PATH = os.environ.get("AIBABY_TRACE_LOG", "")
+
+# Limites (s) dos baldes dos histogramas de duração, do cache em memória até uma geração lenta
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_PREFIX = "aibaby_"
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(DURATION_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class MetricsRegistry:
+    """Contadores e histogramas do processo, exportados no formato texto do Prometheus.
+
+    Os spans (`span`) medem a duração de cada etapa no histograma `aibaby_stage_duration_seconds`
+    e, com `trace_log`, também são gravados como linhas JSON compatíveis com spans do OpenTelemetry."""
+
+    def __init__(self, trace_log=None):
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._trace_file = open(trace_log, "a", buffering=1, encoding="utf-8") if trace_log else None
+
+    def increment(self, name, amount=1, help_text="", **labels):
+        """Soma `amount` ao contador `name` com os rótulos informados."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def observe(self, name, value, help_text="", **labels):
+        """Registra uma duração (s) no histograma `name`."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(value)
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        """Mede o bloco como a etapa `stage`; spans abertos dentro dele (na mesma thread) ficam aninhados."""
+        stack = self._local.__dict__.setdefault("stack", [])
+        parent = stack[-1] if stack else None
+        span_id = uuid.uuid4().hex[:16]
+        trace_id = parent[0] if parent else uuid.uuid4().hex
+        stack.append((trace_id, span_id))
+        started_ns = time.time_ns()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            self.observe("stage_duration_seconds", elapsed, help_text="Duração de cada etapa do pipeline de geração.", stage=stage)
+            if self._trace_file:
+                self._write_span(stage, trace_id, span_id, parent[1] if parent else None, started_ns, started_ns + int(elapsed * 1e9), attributes, error)
+
+    def _write_span(self, name, trace_id, span_id, parent_id, start_ns, end_ns, attributes, error):
+        record = {
+            "name": name,
+            "traceId": trace_id,
+            "spanId": span_id,
+            "parentSpanId": parent_id or "",
+            "startTimeUnixNano": start_ns,
+            "endTimeUnixNano": end_ns,
+            "attributes": {name: value if isinstance(value, (int, float, bool)) else str(value) for name, value in attributes.items()},
+            "status": {"code": "STATUS_CODE_ERROR", "message": str(error)} if error else {"code": "STATUS_CODE_OK"},
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._trace_file.write(line + "\n")
+
+    def render_prometheus(self):
+        """Retorna todas as métricas no formato de exposição em texto do Prometheus."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count)) for key, h in self._histograms.items())
+            help_texts = dict(self._help)
+        lines = []
+        declared = set()
+        for (name, key), value in counters:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# HELP {_PREFIX}{name} {help_texts.get(name, name)}")
+                lines.append(f"# TYPE {_PREFIX}{name} counter")
+            lines.append(f"{_PREFIX}{name}{_format_labels(key)} {value}")
+        for (name, key), (counts, total, count) in histograms:
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# HELP {_PREFIX}{name} {help_texts.get(name, name)}")
+                lines.append(f"# TYPE {_PREFIX}{name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(DURATION_BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f"{_PREFIX}{name}_bucket{_format_labels(key, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{_PREFIX}{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{_PREFIX}{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{_PREFIX}{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def stage_summary(self):
+        """Retorna {etapa: (contagem, média em ms)} do histograma de etapas, para exibição rápida."""
+        with self._lock:
+            return {
+                dict(key)["stage"]: (histogram.count, histogram.sum / histogram.count * 1000)
+                for (name, key), histogram in self._histograms.items()
+                if name == "stage_duration_seconds" and histogram.count
+            }
+
+
+# Registro global do processo, compartilhado por todos os módulos
+METRICS = MetricsRegistry(TRACE_LOG_PATH)
+span = METRICS.span
+increment = METRICS.increment
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port, host="127.0.0.1", registry=METRICS):
+    """Sobe, em uma thread em segundo plano, o endpoint `/metrics` lido pelo Prometheus.
+
+    Por padrão só atende conexões da própria máquina; use `host="0.0.0.0"` para um coletor em outra máquina."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="aibaby-metrics", daemon=True).start()
+    return server
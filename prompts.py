@@ -0,0 +1,100 @@
+import hashlib
+import re
+from collections import namedtuple
+from types import MappingProxyType
+
+# Prompts base para garantir a qualidade e o estilo da imagem
+BASE_PROMPT_TEMPLATE = "ultra realistic 8k photo, {age_desc}, {skin_tone}, cinematic lighting, professional photography, sharp focus, incredibly detailed"
+NEGATIVE_PROMPT = "hands, fingers, deformed hands, mutated hands, arms, blurry, deformed, ugly, disfigured, cartoon, anime, 3d render, painting, text, watermark, signature, extra limbs, missing limbs, body"
+
+# Descrições específicas para cada fase da vida
+AGE_PROMPTS = {
+    # --- ALTERAÇÃO AQUI: PROMPT DO BEBÊ DETALHADO ---
+    'Bebê': 'A close-up photo focusing on the serene face of a newborn baby. The baby is swaddled in a white blanket and wears a striped pink and blue hospital beanie. The background is a surface with a soft, out-of-focus pattern of blue and pink stripes, suggesting a nursery setting. The image highlights the baby\'s delicate features and perfect smooth skin.',
+
+    'Criança': 'cute happy child, 6 years old, smiling, headshot portrait',
+    'Adolescente': 'portrait of a teenager, 16 years old, natural look, high school photo style',
+    'Adulto': 'professional headshot portrait of a young adult, 28 years old, confident expression'
+}
+PHASES = tuple(AGE_PROMPTS)
+
+# Tons de pele oferecidos na interface e a descrição enviada ao modelo
+SKIN_TONES = {
+    'Automático': 'beautiful diverse heritage',
+    'Muito Claro': 'very light, pale caucasian skin',
+    'Claro': 'light, fair caucasian skin',
+    'Moreno Claro': 'light brown, mediterranean skin',
+    'Moreno Escuro': 'dark brown, south asian skin',
+    'Negro': 'deep dark, african skin'
+}
+
+# Termos substituídos em cada gênero; as chaves são sequências de palavras inteiras, nunca pedaços de palavras
+GENDER_TERMS = {
+    'Menino': {('newborn', 'baby'): 'newborn baby boy', ('child',): 'boy', ('teenager',): 'male teenager', ('adult',): 'man'},
+    'Menina': {('newborn', 'baby'): 'newborn baby girl', ('child',): 'girl', ('teenager',): 'female teenager', ('adult',): 'woman'},
+}
+GENDERS = tuple(GENDER_TERMS)
+
+_TOKEN_PATTERN = re.compile(r"\w+|\W+")
+
+Prompt = namedtuple("Prompt", ("text", "key"))
+
+
+def prompt_key(text):
+    """Calcula o hash estável (SHA-256) de um prompt, ignorando diferenças de espaços."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def replace_terms(text, terms):
+    """Substitui os termos por palavras inteiras: 'child' troca em 'cute child', mas não em 'childhood'."""
+    tokens = _TOKEN_PATTERN.findall(text)
+    # Sequências mais longas primeiro, para que 'newborn baby' tenha preferência sobre termos menores
+    phrases = sorted(terms, key=len, reverse=True)
+    output = []
+    index = 0
+    while index < len(tokens):
+        for phrase in phrases:
+            end = _match_phrase(tokens, index, phrase)
+            if end is not None:
+                output.append(terms[phrase])
+                index = end
+                break
+        else:
+            output.append(tokens[index])
+            index += 1
+    return "".join(output)
+
+
+def _match_phrase(tokens, index, phrase):
+    # Retorna o índice logo após a sequência de palavras, separadas apenas por espaços, ou None
+    for position, word in enumerate(phrase):
+        if position:
+            if index >= len(tokens) or not tokens[index].isspace():
+                return None
+            index += 1
+        if index >= len(tokens) or tokens[index].lower() != word:
+            return None
+        index += 1
+    return index
+
+
+def compile_prompts(template=BASE_PROMPT_TEMPLATE, age_prompts=AGE_PROMPTS, skin_tones=SKIN_TONES, gender_terms=GENDER_TERMS):
+    """Monta de uma vez todos os prompts (fase × gênero × tom de pele) em uma tabela imutável de `Prompt`."""
+    table = {}
+    for gender, terms in gender_terms.items():
+        for phase, age_desc in age_prompts.items():
+            gendered = replace_terms(age_desc, terms)
+            for tone, skin_tone in skin_tones.items():
+                text = template.format(age_desc=gendered, skin_tone=skin_tone)
+                table[(phase, gender, tone)] = Prompt(text, prompt_key(text))
+    return MappingProxyType(table)
+
+
+# Tabela calculada uma única vez, na importação do módulo
+PROMPTS = compile_prompts()
+PROMPTS_BY_KEY = MappingProxyType({prompt.key: prompt for prompt in PROMPTS.values()})
+
+
+def get_prompt(phase, gender, skin_tone):
+    """Retorna o `Prompt` pré-calculado de uma fase, gênero ('Menino'/'Menina') e tom de pele (rótulo de `SKIN_TONES`)."""
+    return PROMPTS[(phase, gender, skin_tone)]
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Limite (MB) da camada em disco (AIBABY_CACHE_DIR), somando todos os processos que a usam; 0 desativa
+DISK_MAX_MB = int(os.environ.get("AIBABY_CACHE_DISK_MAX_MB", "2048"))
+
+# Ao passar do limite, a camada em disco é reduzida a esta fração dele, para não varrer o diretório a cada gravação
+DISK_TRIM_RATIO = 0.9
+
+
+def normalize_payload(value):
+    """Normaliza o payload (espaços extras nas strings) para que prompts equivalentes gerem a mesma chave."""
+    if isinstance(value, dict):
+        return {key: normalize_payload(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_payload(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def payload_key(payload, api_url):
+    """Calcula a chave de conteúdo (SHA-256) de um payload normalizado para uma URL da API."""
+    canonical = json.dumps(normalize_payload(payload), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(f"{api_url}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Cache dos bytes das imagens geradas, com camada LRU em memória e camadas opcionais compartilhada e em disco.
+
+    A camada compartilhada (`shared`, ver shared_store.py) é vista por todas as réplicas do app;
+    suas entradas expiram após `shared_ttl` segundos. A camada em disco fica abaixo de
+    `max_disk_bytes`: os arquivos lidos ou gravados há mais tempo (mtime) saem primeiro."""
+
+    def __init__(self, max_bytes, directory=None, shared=None, shared_ttl=86400, max_disk_bytes=DISK_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.max_disk_bytes = max_disk_bytes
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.bin")
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def get(self, key):
+        """Retorna os bytes armazenados para a chave, ou None se não estiverem no cache."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return data
+        if self.shared is not None:
+            record = self.shared.get(f"result:{key}")
+            if record is not None:
+                with self._lock:
+                    self._remember(key, record[0])
+                    self.shared_hits += 1
+                return record[0]
+        if self.directory:
+            try:
+                with open(self._path(key), "rb") as handle:
+                    data = handle.read()
+                # A leitura renova o arquivo: as imagens mais pedidas (ex.: a galeria) não saem do disco
+                os.utime(self._path(key))
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self._remember(key, data)
+                    self.disk_hits += 1
+                return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def contains(self, key):
+        """Indica se a chave está no cache, sem alterar os contadores nem a ordem do LRU."""
+        with self._lock:
+            if key in self._entries:
+                return True
+        if self.shared is not None and self.shared.contains(f"result:{key}"):
+            return True
+        return bool(self.directory) and os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        """Armazena os bytes da imagem na memória e, se configurado, no estado compartilhado e no disco."""
+        with self._lock:
+            self._remember(key, data)
+        if self.shared is not None:
+            self.shared.put(f"result:{key}", data, self.shared_ttl)
+        if self.directory:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(data)
+            os.replace(tmp_path, path)
+            if self.max_disk_bytes:
+                with self._disk_lock:
+                    if self._disk_bytes is not None:
+                        self._disk_bytes += len(data)
+                    if self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes:
+                        self._disk_bytes = self._trim_disk()
+
+    def _trim_disk(self):
+        # Outros processos também gravam no diretório: o total é recontado a cada limpeza
+        files = []
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.endswith(".bin"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total <= self.max_disk_bytes:
+            return total
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes * DISK_TRIM_RATIO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def stats(self):
+        """Retorna os contadores de acertos e falhas e o uso atual de memória."""
+        with self._lock:
+            return {
+                "hits": self.memory_hits + self.shared_hits + self.disk_hits,
+                "memory_hits": self.memory_hits,
+                "shared_hits": self.shared_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
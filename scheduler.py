@@ -0,0 +1,195 @@
+import hashlib
+import itertools
+import threading
+import time
+
+# Prioridades da fila: números menores são atendidos primeiro
+PRIORITY_SINGLE = 0
+PRIORITY_GRID = 1
+PRIORITY_BACKGROUND = 2
+
+
+class QueueTimeout(Exception):
+    """O pedido esperou na fila mais que o tempo máximo permitido."""
+
+
+class TokenBucket:
+    """Balde de tokens: `rate` tokens por segundo, acumulando no máximo `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost, now):
+        """Segundos até haver `cost` tokens disponíveis (pedidos maiores que a capacidade esperam o balde encher)."""
+        self._refill(now)
+        missing = min(cost, self.capacity) - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, cost, now):
+        self._refill(now)
+        self.tokens -= min(cost, self.capacity)
+
+
+class SharedTokenBucket:
+    """Balde de tokens guardado no estado compartilhado (ver shared_store.py), dividido por todas as réplicas.
+
+    Duas réplicas podem liberar pedidos ao mesmo tempo com base no mesmo saldo: o balde fica
+    negativo e os pedidos seguintes esperam até a dívida ser paga."""
+
+    def __init__(self, store, name, rate, capacity):
+        self.store = store
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, cost, now):
+        self.updated = now
+        missing = min(cost, self.capacity) - self.store.bucket_tokens(self.name, self.rate, self.capacity)
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, cost, now):
+        self.updated = now
+        self.store.consume_tokens(self.name, self.rate, self.capacity, min(cost, self.capacity))
+
+
+class _Ticket:
+    __slots__ = ("session_id", "key_id", "priority", "cost", "seq")
+
+    def __init__(self, session_id, key_id, priority, cost, seq):
+        self.session_id = session_id
+        self.key_id = key_id
+        self.priority = priority
+        self.cost = cost
+        self.seq = seq
+
+
+class FairScheduler:
+    """Fila global e justa na frente das requisições ao backend.
+
+    Cada pedido consome `cost` tokens de três baldes: o global, o da sessão e o da chave
+    de API. Entre os pedidos pendentes, os de menor prioridade numérica vêm primeiro e,
+    dentro de uma mesma prioridade, a sessão atendida há mais tempo tem a vez, de modo que
+    uma sessão gerando muitas grades não impede as outras de serem atendidas.
+
+    Com `bucket_store` (ver shared_store.py), os baldes ficam no estado compartilhado e os
+    limites valem para todas as réplicas juntas; a ordem justa continua sendo por processo."""
+
+    def __init__(self, global_rate, global_burst, session_rate, session_burst, key_rate, key_burst, idle_ttl=3600, bucket_store=None):
+        self._cond = threading.Condition()
+        self.bucket_store = bucket_store
+        self._global = self._new_bucket("global", global_rate, global_burst)
+        self._session_limits = (session_rate, session_burst)
+        self._key_limits = (key_rate, key_burst)
+        self._session_buckets = {}
+        self._key_buckets = {}
+        self._last_served = {}
+        self._pending = []
+        self._seq = itertools.count()
+        self.idle_ttl = idle_ttl
+        # Incrementado a cada aviso às threads em espera, para quem estava fora do lock perceber a mudança
+        self._changes = 0
+        self.admitted = 0
+        self.timeouts = 0
+
+    def _new_bucket(self, name, rate, capacity):
+        if self.bucket_store is None:
+            return TokenBucket(rate, capacity)
+        return SharedTokenBucket(self.bucket_store, name, rate, capacity)
+
+    def _bucket(self, buckets, limits, name):
+        bucket = buckets.get(name)
+        if bucket is None:
+            bucket = buckets[name] = self._new_bucket(name, *limits)
+        return bucket
+
+    def _buckets_for(self, ticket):
+        buckets = [self._global, self._bucket(self._session_buckets, self._session_limits, f"session:{ticket.session_id}")]
+        if ticket.key_id:
+            buckets.append(self._bucket(self._key_buckets, self._key_limits, f"key:{ticket.key_id}"))
+        return buckets
+
+    def _fair_order(self):
+        return sorted(self._pending, key=lambda t: (t.priority, self._last_served.get(t.session_id, 0.0), t.seq))
+
+    def _forget_idle(self, now):
+        # Remove os baldes de sessões e chaves paradas há muito tempo (já estariam cheios de novo)
+        for buckets in (self._session_buckets, self._key_buckets):
+            for name in [name for name, bucket in buckets.items() if now - bucket.updated > self.idle_ttl]:
+                del buckets[name]
+        for session_id in [sid for sid, served in self._last_served.items() if now - served > self.idle_ttl]:
+            del self._last_served[session_id]
+
+    def acquire(self, session_id, api_key, priority, cost=1, on_wait=None, timeout=None):
+        """Bloqueia até o pedido ser liberado, consumindo os tokens necessários.
+
+        `on_wait(posicao, espera_estimada)` é chamado periodicamente, na thread que chamou,
+        enquanto o pedido aguarda; posição 0 significa que ele é o próximo da fila."""
+        key_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else None
+        started = time.monotonic()
+        with self._cond:
+            ticket = _Ticket(session_id, key_id, priority, cost, next(self._seq))
+            self._pending.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    order = self._fair_order()
+                    next_change = 0.5
+                    for candidate in order:
+                        wait = max(bucket.wait_time(candidate.cost, now) for bucket in self._buckets_for(candidate))
+                        if wait == 0.0:
+                            break
+                        next_change = min(next_change, wait)
+                    else:
+                        candidate = None
+                    if candidate is ticket:
+                        for bucket in self._buckets_for(ticket):
+                            bucket.consume(ticket.cost, now)
+                        self._last_served[session_id] = now
+                        self.admitted += 1
+                        self._forget_idle(now)
+                        return
+                    if candidate is not None:
+                        # Outro pedido pode ser liberado agora: acorda as threads para que ele siga
+                        self._changes += 1
+                        self._cond.notify_all()
+                    if timeout is not None and now - started >= timeout:
+                        self.timeouts += 1
+                        raise QueueTimeout(f"Tempo máximo de espera na fila ({timeout:.0f}s) excedido.")
+                    if on_wait:
+                        position = order.index(ticket)
+                        estimated = max(
+                            max(bucket.wait_time(cost, now) for bucket in self._buckets_for(ticket)),
+                            sum(t.cost for t in order[:position]) / self._global.rate if self._global.rate > 0 else 0.0,
+                        )
+                        seen = self._changes
+                        # O callback pode ser lento (ex.: gravar o progresso do job no SQLite): roda fora do lock da fila
+                        self._cond.release()
+                        try:
+                            on_wait(position, estimated)
+                        finally:
+                            self._cond.acquire()
+                        if self._changes != seen:
+                            continue
+                    self._cond.wait(next_change)
+            finally:
+                if ticket in self._pending:
+                    self._pending.remove(ticket)
+                self._changes += 1
+                self._cond.notify_all()
+
+    def stats(self):
+        """Retorna o tamanho da fila e os contadores de pedidos liberados e expirados."""
+        with self._cond:
+            return {"queued": len(self._pending), "admitted": self.admitted, "timeouts": self.timeouts}
@@ -0,0 +1,158 @@
+"""Harness de várias réplicas: sobe processos com o núcleo do app (core.py) apontando para o mesmo
+estado compartilhado e verifica, contra o servidor stub local, que:
+
+- cada payload distinto chega ao backend uma única vez, mesmo pedido por todas as réplicas ao mesmo tempo;
+- o limite global de requisições vale para as réplicas somadas, não para cada uma;
+- os jobs e as imagens de uma réplica podem ser lidos por outra (ex.: após um recarregamento da página).
+
+Com `--store memory` cada processo fica com o próprio estado, como antes: serve de referência e
+mostra as requisições duplicadas e o limite multiplicado pelo número de réplicas.
+
+Uso:
+    python shared_harness.py --processes 4 --configs 3
+    python shared_harness.py --processes 4 --store memory
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from prompts import PHASES, SKIN_TONES
+
+# Folga no limite global para pedidos liberados ao mesmo tempo por réplicas diferentes (ver SharedTokenBucket)
+QUOTA_SLACK = 1
+
+
+def grid_configs(count):
+    """As primeiras `count` combinações de gênero e tom de pele, na mesma ordem em todas as réplicas."""
+    return [(gender, skin_tone) for skin_tone in SKIN_TONES for gender in ("Menino", "Menina")][:count]
+
+
+def run_worker(args):
+    """Executa uma réplica: gera as grades das combinações, pede `--acquires` vagas na fila e imprime um relatório JSON."""
+    import uuid
+
+    from core import (
+        Services, build_request, create_http_session, create_image_store, create_inference_backend, create_job_manager,
+        create_result_cache, create_scheduler, create_shared_store, create_single_flight, grid_job,
+    )
+    from prompts import get_prompt
+    from scheduler import PRIORITY_SINGLE
+
+    shared = create_shared_store()
+    services = Services(create_inference_backend(create_http_session()), create_result_cache(shared), create_single_flight(shared), create_scheduler(shared), create_image_store(shared))
+    job_manager = create_job_manager()
+    session_id = uuid.uuid4().hex
+    time.sleep(max(0.0, args.start_at - time.time()))
+
+    job_ids = []
+    for gender, skin_tone in grid_configs(args.configs):
+        payloads = {phase: build_request(get_prompt(phase, gender, skin_tone).text, 0, None) for phase in PHASES}
+        job = grid_job(services, session_id, "", {}, payloads, False, f"progressao_{gender.lower()}", f"{gender} - {skin_tone}")
+        job_ids.append(job_manager.submit(session_id, "grid", job.run, total=len(payloads), admit=job.admit))
+    for job_id in job_ids:
+        job_manager.wait(job_id, timeout=args.timeout)
+
+    # Segunda etapa: só a fila, com pedidos de custo 1, para medir o limite global somado das réplicas
+    admitted = []
+    for _ in range(args.acquires):
+        services.scheduler.acquire(session_id, "", PRIORITY_SINGLE, cost=1, timeout=args.timeout)
+        admitted.append(time.time())
+
+    jobs = [job_manager.get(job_id) for job_id in job_ids]
+    print(json.dumps({
+        "pid": os.getpid(),
+        "session_id": session_id,
+        "jobs": [{"id": job["id"], "status": job["status"], "result": job["result"]} for job in jobs],
+        "admitted": admitted,
+        "flight": services.flight.stats(),
+        "cache": services.cache.stats(),
+    }))
+
+
+def check_quota(admitted, rate, burst):
+    """Retorna o maior excesso de pedidos liberados, em qualquer janela, sobre o que o limite global permite."""
+    admitted = sorted(admitted)
+    excess = 0.0
+    for start in range(len(admitted)):
+        for end in range(start, len(admitted)):
+            allowed = burst + rate * (admitted[end] - admitted[start])
+            excess = max(excess, (end - start + 1) - allowed)
+    return excess
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verifica o estado compartilhado entre várias réplicas do app contra o servidor stub.")
+    parser.add_argument("--processes", type=int, default=4, help="Réplicas (processos) do app.")
+    parser.add_argument("--configs", type=int, default=3, help="Combinações de gênero e tom de pele geradas por todas as réplicas.")
+    parser.add_argument("--store", choices=("sqlite", "memory"), default="sqlite", help="Estado compartilhado (SQLite) ou só em processo (referência).")
+    parser.add_argument("--latency", type=float, default=0.5, help="Latência do servidor stub (s).")
+    parser.add_argument("--rate", type=float, default=120, help="Limite global de requisições por minuto.")
+    parser.add_argument("--burst", type=float, default=4, help="Rajada máxima do limite global.")
+    parser.add_argument("--acquires", type=int, default=4, help="Vagas na fila pedidas por réplica na etapa do limite global.")
+    parser.add_argument("--timeout", type=float, default=120, help="Tempo máximo de espera por job e por vaga na fila (s).")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, default=0.0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return 0
+
+    from stub_server import start_in_background
+    server, url = start_in_background(port=0, latency=args.latency, size=64)
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "shared.db") if args.store == "sqlite" else ""
+        env = dict(
+            os.environ, AIBABY_BACKEND="stub", AIBABY_API_URL=url, AIBABY_ENDPOINTS="", AIBABY_CACHE_DIR="",
+            AIBABY_SHARED_DB=db_path, AIBABY_JOB_DB="", AIBABY_RATE_GLOBAL_PER_MIN=str(args.rate), AIBABY_RATE_GLOBAL_BURST=str(args.burst),
+            AIBABY_RATE_SESSION_PER_MIN="100000", AIBABY_RATE_SESSION_BURST="100000", AIBABY_QUEUE_TIMEOUT=str(args.timeout),
+        )
+        command = [sys.executable, os.path.abspath(__file__), "--worker", "--configs", str(args.configs), "--acquires", str(args.acquires),
+                   "--timeout", str(args.timeout), "--start-at", str(time.time() + 2)]
+        workers = [subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True) for _ in range(args.processes)]
+        reports = []
+        for worker in workers:
+            output, _ = worker.communicate()
+            if worker.returncode != 0:
+                print(f"A réplica {worker.pid} terminou com código {worker.returncode}.")
+                return 1
+            reports.append(json.loads(output.strip().splitlines()[-1]))
+        server.shutdown()
+
+        distinct = args.configs * len(PHASES)
+        sent = sum(server.received.values())
+        jobs_done = sum(job["status"] == "done" for report in reports for job in report["jobs"])
+        remote = sum(report["flight"]["coalesced_remote"] for report in reports)
+        excess = check_quota([moment for report in reports for moment in report["admitted"]], args.rate / 60, args.burst)
+        checks = [
+            (f"Requisições ao backend: {sent} para {distinct} payloads distintos ({remote} agrupadas com outra réplica)", sent == distinct),
+            (f"Jobs concluídos: {jobs_done}/{args.processes * args.configs}", jobs_done == args.processes * args.configs),
+            (f"Limite global somado das réplicas: excesso máximo de {excess:.1f} pedido(s) (folga de {QUOTA_SLACK})", excess <= QUOTA_SLACK),
+        ]
+        if db_path:
+            from image_store import ImageStore
+            from jobs import SQLiteJobStore
+            from shared_store import SQLiteSharedStore
+
+            # Lê tudo de um processo que não gerou nada, como uma réplica que recebe a sessão após um recarregamento
+            job_store = SQLiteJobStore(db_path)
+            image_store = ImageStore(0, 3600, shared=SQLiteSharedStore(db_path))
+            readable = sum(
+                job_store.get(job["id"])["status"] == "done" and image_store.get(job["result"]) is not None
+                for report in reports for job in report["jobs"]
+            )
+            histories = sum(len(image_store.history(report["session_id"])) == min(args.configs, image_store.history_size) for report in reports)
+            checks.append((f"Jobs e imagens lidos por outro processo: {readable}/{jobs_done}", readable == jobs_done))
+            checks.append((f"Históricos das sessões lidos por outro processo: {histories}/{args.processes}", histories == args.processes))
+
+    for description, passed in checks:
+        print(f"[{'ok' if passed else 'FALHOU'}] {description}")
+    return 0 if all(passed for _, passed in checks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
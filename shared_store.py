@@ -0,0 +1,244 @@
+"""Estado compartilhado entre réplicas do app: resultados, imagens, reservas de pedidos em andamento e baldes de tokens.
+
+`MemorySharedStore` mantém tudo no processo; `SQLiteSharedStore` usa um banco SQLite em modo WAL,
+compartilhado por todos os processos que apontam para o mesmo arquivo (AIBABY_SHARED_DB). Os dois
+têm a mesma interface, usada pelo cache de resultados, pelo agrupador de pedidos, pela fila e pelo
+armazenamento de imagens.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+
+def _tokens_now(tokens, updated, rate, capacity, now):
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+class MemorySharedStore:
+    """Implementação em processo do estado compartilhado: nada é visto por outros processos.
+
+    Serve para uma única réplica e como referência da interface de `SQLiteSharedStore`."""
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._records = {}
+        self._claims = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, data, ttl, meta=None, owner=None, parent=None):
+        """Guarda os bytes de `key` por `ttl` segundos, com metadados, dono (sessão) e entrada de origem opcionais."""
+        now = time.time()
+        with self._lock:
+            # Como no SQLite, as entradas vencidas saem a cada gravação; `get` só as esconde
+            for expired in [name for name, record in self._records.items() if record[5] < now]:
+                del self._records[expired]
+            self._records[key] = (data, meta, owner, parent, now, now + ttl)
+            if self.max_bytes:
+                self._evict(key)
+
+    def _evict(self, key):
+        # Remove as entradas mais antigas (exceto a recém-guardada) até o total caber em `max_bytes`
+        total = sum(len(record[0]) for record in self._records.values())
+        for old_key in sorted(self._records, key=lambda name: self._records[name][4]):
+            if total <= self.max_bytes:
+                break
+            if old_key != key:
+                total -= len(self._records.pop(old_key)[0])
+
+    def get(self, key):
+        """Retorna (bytes, metadados) de `key`, ou None se não existir ou tiver expirado."""
+        with self._lock:
+            record = self._records.get(key)
+            if record is None or record[5] < time.time():
+                return None
+            return record[0], record[1]
+
+    def delete(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def contains(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            return record is not None and record[5] >= time.time()
+
+    def children(self, parent):
+        """Lista (chave, metadados) das entradas derivadas de `parent`, na ordem em que foram guardadas."""
+        now = time.time()
+        with self._lock:
+            found = [(record[4], key, record[1]) for key, record in self._records.items() if record[3] == parent and record[5] >= now]
+        return [(key, meta) for _, key, meta in sorted(found, key=lambda item: item[0])]
+
+    def recent(self, owner, limit):
+        """Lista (chave, metadados) das últimas `limit` entradas principais (sem origem) do dono, da mais recente para a mais antiga."""
+        now = time.time()
+        with self._lock:
+            found = [(record[4], key, record[1]) for key, record in self._records.items() if record[2] == owner and record[3] is None and record[5] >= now]
+        return [(key, meta) for _, key, meta in sorted(found, key=lambda item: item[0], reverse=True)[:limit]]
+
+    def claim(self, key, owner, ttl):
+        """Reserva `key` para `owner` por até `ttl` segundos; retorna False se outro dono já a reservou."""
+        now = time.time()
+        with self._lock:
+            current = self._claims.get(key)
+            if current is not None and current[1] >= now and current[0] != owner:
+                return False
+            self._claims[key] = (owner, now + ttl)
+            return True
+
+    def release(self, key, owner):
+        with self._lock:
+            if self._claims.get(key, (None,))[0] == owner:
+                del self._claims[key]
+
+    def is_claimed(self, key):
+        with self._lock:
+            current = self._claims.get(key)
+            return current is not None and current[1] >= time.time()
+
+    def bucket_tokens(self, name, rate, capacity):
+        """Retorna os tokens disponíveis agora no balde `name` (cheio, se ainda não existir)."""
+        with self._lock:
+            tokens, updated = self._buckets.get(name, (capacity, None))
+            return tokens if updated is None else _tokens_now(tokens, updated, rate, capacity, time.time())
+
+    def consume_tokens(self, name, rate, capacity, cost):
+        """Retira `cost` tokens do balde; o saldo pode ficar negativo e é pago pelos próximos pedidos."""
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(name, (capacity, None))
+            if updated is not None:
+                tokens = _tokens_now(tokens, updated, rate, capacity, now)
+            self._buckets[name] = (tokens - cost, now)
+
+
+class SQLiteSharedStore:
+    """Estado compartilhado em um banco SQLite (modo WAL), visto por todos os processos do mesmo nó.
+
+    As atualizações de reservas e baldes são feitas em transações `BEGIN IMMEDIATE`, de modo que
+    dois processos nunca reservam a mesma chave nem leem o mesmo saldo antes de descontá-lo.
+
+    Com `max_bytes`, cada `put` remove as entradas mais antigas até os dados de todas as réplicas
+    somados caberem no limite; o espaço liberado é reaproveitado pelo banco (e devolvido ao disco
+    em bancos criados por esta classe, que usam `auto_vacuum` incremental)."""
+
+    def __init__(self, path, busy_timeout=5.0, max_bytes=0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=busy_timeout)
+        # Só vale para um banco novo: precisa vir antes da criação das tabelas
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, data BLOB, meta TEXT, owner TEXT, parent TEXT, created REAL, expires REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_owner ON records (owner, created)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_parent ON records (parent, created)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_expires ON records (expires)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_created ON records (created)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _transaction(self, func):
+        # Chamado com self._lock: a transação trava o banco para escrita desde o início
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func()
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        return result
+
+    def put(self, key, data, ttl, meta=None, owner=None, parent=None):
+        def put():
+            now = time.time()
+            removed = self._conn.execute("DELETE FROM records WHERE expires < ?", (now,)).rowcount
+            self._conn.execute(
+                "INSERT OR REPLACE INTO records (key, data, meta, owner, parent, created, expires) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, data, json.dumps(meta) if meta is not None else None, owner, parent, now, now + ttl),
+            )
+            return removed + (self._evict(key) if self.max_bytes else 0)
+
+        with self._lock:
+            if self._transaction(put):
+                # Devolve ao disco as páginas liberadas (sem efeito em bancos sem auto_vacuum incremental)
+                self._conn.execute("PRAGMA incremental_vacuum")
+
+    def _evict(self, key):
+        # Chamado dentro da transação de `put`, para que duas réplicas não removam com base no mesmo total
+        total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM records").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        evicted = []
+        for old_key, size in self._conn.execute("SELECT key, LENGTH(data) FROM records WHERE key != ? ORDER BY created", (key,)).fetchall():
+            if total <= self.max_bytes:
+                break
+            evicted.append((old_key,))
+            total -= size or 0
+        self._conn.executemany("DELETE FROM records WHERE key = ?", evicted)
+        return len(evicted)
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT data, meta FROM records WHERE key = ? AND expires >= ?", (key, time.time())).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM records WHERE key = ?", (key,))
+
+    def contains(self, key):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM records WHERE key = ? AND expires >= ?", (key, time.time())).fetchone() is not None
+
+    def children(self, parent):
+        with self._lock:
+            rows = self._conn.execute("SELECT key, meta FROM records WHERE parent = ? AND expires >= ? ORDER BY created", (parent, time.time())).fetchall()
+        return [(key, json.loads(meta) if meta else None) for key, meta in rows]
+
+    def recent(self, owner, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, meta FROM records WHERE owner = ? AND parent IS NULL AND expires >= ? ORDER BY created DESC LIMIT ?",
+                (owner, time.time(), limit),
+            ).fetchall()
+        return [(key, json.loads(meta) if meta else None) for key, meta in rows]
+
+    def claim(self, key, owner, ttl):
+        def claim():
+            now = time.time()
+            self._conn.execute("DELETE FROM claims WHERE key = ? AND (expires < ? OR owner = ?)", (key, now, owner))
+            return self._conn.execute("INSERT OR IGNORE INTO claims (key, owner, expires) VALUES (?, ?, ?)", (key, owner, now + ttl)).rowcount == 1
+
+        with self._lock:
+            return self._transaction(claim)
+
+    def release(self, key, owner):
+        with self._lock:
+            self._conn.execute("DELETE FROM claims WHERE key = ? AND owner = ?", (key, owner))
+
+    def is_claimed(self, key):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM claims WHERE key = ? AND expires >= ?", (key, time.time())).fetchone() is not None
+
+    def bucket_tokens(self, name, rate, capacity):
+        with self._lock:
+            row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+        return capacity if row is None else _tokens_now(row[0], row[1], rate, capacity, time.time())
+
+    def consume_tokens(self, name, rate, capacity, cost):
+        def consume():
+            now = time.time()
+            row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens = capacity if row is None else _tokens_now(row[0], row[1], rate, capacity, now)
+            self._conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (name, tokens - cost, now))
+
+        with self._lock:
+            self._transaction(consume)
@@ -0,0 +1,85 @@
+import os
+import socket
+import threading
+import time
+
+# Pausa (s) entre as consultas de quem espera a execução de outro processo terminar
+CLAIM_POLL_INTERVAL = 0.2
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Agrupa chamadas idênticas simultâneas: só a primeira executa, as demais esperam e recebem o mesmo resultado.
+
+    Com `shared` (ver shared_store.py), a execução também é reservada no estado compartilhado:
+    se outra réplica já está executando a mesma chave, esta espera a reserva ser liberada (ou
+    expirar após `claim_ttl` segundos) antes de executar `func()`, que deve então encontrar o
+    resultado no cache compartilhado."""
+
+    def __init__(self, shared=None, claim_ttl=300):
+        self.shared = shared
+        self.claim_ttl = claim_ttl
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+        self.coalesced_remote = 0
+
+    def do(self, key, func, rerun_on=None):
+        """Executa `func()` para a chave ou, se já houver uma execução em andamento, aguarda o resultado dela.
+
+        Se a execução em andamento falhar com um erro para o qual `rerun_on(erro)` é verdadeiro (ex.: a
+        chave de API de quem a iniciou é inválida), quem estava esperando executa de novo por conta própria."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None and rerun_on is not None and rerun_on(call.error):
+                return self.do(key, func, rerun_on)
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = self._run_claimed(key, func) if self.shared is not None else func()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def _run_claimed(self, key, func):
+        waited = False
+        while not self.shared.claim(f"flight:{key}", self._owner, self.claim_ttl):
+            waited = True
+            while self.shared.is_claimed(f"flight:{key}"):
+                time.sleep(CLAIM_POLL_INTERVAL)
+        if waited:
+            with self._lock:
+                self.coalesced_remote += 1
+        try:
+            return func()
+        finally:
+            self.shared.release(f"flight:{key}", self._owner)
+
+    def stats(self):
+        """Retorna quantas chamadas foram executadas e quantas aproveitaram uma execução em andamento (neste ou em outro processo)."""
+        with self._lock:
+            return {"executed": self.executed, "coalesced": self.coalesced, "coalesced_remote": self.coalesced_remote, "in_flight": len(self._calls)}
@@ -0,0 +1,160 @@
+"""Servidor HTTP local que imita a API de Inferência da Hugging Face para testes de carga.
+
+Responde a `POST /models/<modelo>` com um PNG determinístico (derivado do payload), com
+latência configurável e injeção de erros (503 com `estimated_time`, 429 e 500).
+
+Uso:
+    python stub_server.py --port 8765 --latency 2 --jitter 0.5 --loading-rate 0.1
+    AIBABY_BACKEND=stub streamlit run "code (5).py"
+"""
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+@lru_cache(maxsize=64)
+def render_png(digest, width, height):
+    """Gera um PNG RGB com um degradê cujas cores são derivadas do `digest` do payload."""
+    start, end = digest[:3], digest[3:6]
+    rows = []
+    for y in range(height):
+        t = y / max(1, height - 1)
+        pixel = bytes(int(a + (b - a) * t) for a, b in zip(start, end))
+        rows.append(b"\x00" + pixel * width)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(b"".join(rows), 1))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Trata as requisições de geração conforme a configuração do servidor."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type, extra_headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error_json(self, status, body, extra_headers=None):
+        self._send(status, json.dumps(body).encode("utf-8"), "application/json", extra_headers)
+
+    def do_GET(self):
+        # Verificação de saúde do pool de endpoints
+        self._send(200, b'{"status": "ok"}', "application/json")
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            payload = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_error_json(400, {"error": "Invalid JSON payload"})
+            return
+
+        config = self.server
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).digest()
+        with config.rng_lock:
+            config.received[digest.hex()] += 1
+            roll = config.rng.random()
+            delay = max(0.0, config.latency + config.rng.uniform(-config.jitter, config.jitter))
+        time.sleep(delay)
+
+        if roll < config.loading_rate:
+            self._send_error_json(503, {"error": "Model stub is currently loading", "estimated_time": config.estimated_time})
+            return
+        roll -= config.loading_rate
+        if roll < config.rate_limit_rate:
+            self._send_error_json(429, {"error": "Rate limit reached"}, {"Retry-After": str(config.retry_after)})
+            return
+        roll -= config.rate_limit_rate
+        if roll < config.error_rate:
+            self._send_error_json(500, {"error": "Injected server error"})
+            return
+
+        parameters = payload.get("parameters") or {}
+        width = int(parameters.get("width") or config.size)
+        height = int(parameters.get("height") or config.size)
+        self._send(200, render_png(digest, width, height), "image/png")
+
+
+def create_server(host="127.0.0.1", port=8765, latency=0.0, jitter=0.0, size=1024, loading_rate=0.0,
+                  rate_limit_rate=0.0, error_rate=0.0, estimated_time=1.0, retry_after=1, seed=None, verbose=False):
+    """Cria (sem iniciar) o servidor stub; use `port=0` para escolher uma porta livre."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.size = size
+    server.loading_rate = loading_rate
+    server.rate_limit_rate = rate_limit_rate
+    server.error_rate = error_rate
+    server.estimated_time = estimated_time
+    server.retry_after = retry_after
+    server.rng = random.Random(seed)
+    server.rng_lock = threading.Lock()
+    # Requisições recebidas por payload (hash), lidas por harnesses de teste
+    server.received = Counter()
+    server.verbose = verbose
+    return server
+
+
+def start_in_background(**options):
+    """Inicia o servidor stub em uma thread daemon e retorna (servidor, url_do_modelo)."""
+    server = create_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/models/stub"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor stub da API de Inferência para testes de carga.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Latência média de cada geração, em segundos.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Variação máxima (+/-) da latência, em segundos.")
+    parser.add_argument("--size", type=int, default=1024, help="Largura e altura padrão das imagens geradas.")
+    parser.add_argument("--loading-rate", type=float, default=0.0, help="Fração de respostas 503 'model is loading'.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fração de respostas 429.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas 500.")
+    parser.add_argument("--estimated-time", type=float, default=1.0, help="estimated_time enviado nas respostas 503.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After enviado nas respostas 429.")
+    parser.add_argument("--seed", type=int, default=None, help="Semente da injeção de erros e da latência.")
+    parser.add_argument("--verbose", action="store_true", help="Registra cada requisição no terminal.")
+    args = parser.parse_args()
+
+    server = create_server(**vars(args))
+    print(f"Servidor stub em http://{args.host}:{server.server_address[1]}/models/stub")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
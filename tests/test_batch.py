@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import build_http_session, create_backend  # noqa: E402
+from batch import RESULTS_FILE, ManifestError, parse_config, run_batch  # noqa: E402
+from result_cache import ResultCache  # noqa: E402
+from stub_server import start_in_background  # noqa: E402
+
+
+@pytest.fixture
+def backend():
+    server, url = start_in_background(port=0, latency=0, size=16)
+    yield create_backend("stub", build_http_session(4), url=url)
+    server.shutdown()
+    server.server_close()
+
+
+def run(configs, output_dir, backend):
+    return run_batch(configs, str(output_dir), {}, backend, ResultCache(0), max_workers=4)
+
+
+def test_resumed_batch_skips_finished_items(tmp_path, backend):
+    configs = [parse_config({"id": "a", "gender": "Menino", "phases": "Bebê;Criança", "seeds": "1", "grid": "1"}, 2)]
+    assert run(configs, tmp_path, backend) == {"total": 2, "skipped": 0, "generated": 2, "failed": 0, "grids": 1}
+    assert run(configs, tmp_path, backend) == {"total": 2, "skipped": 2, "generated": 0, "failed": 0, "grids": 0}
+
+
+def test_edited_config_is_generated_again(tmp_path, backend):
+    row = {"id": "a", "gender": "Menino", "phases": "Bebê;Criança", "seeds": "1", "grid": "1"}
+    run([parse_config(row, 2)], tmp_path, backend)
+
+    # Mesmo id com outro gênero: as imagens e a grade antigas não valem para a linha nova
+    summary = run([parse_config(dict(row, gender="Menina"), 2)], tmp_path, backend)
+    assert summary == {"total": 2, "skipped": 0, "generated": 2, "failed": 0, "grids": 1}
+
+
+def test_write_error_becomes_a_failed_row(tmp_path, backend):
+    # Um diretório no lugar do arquivo temporário faz a gravação falhar com OSError
+    os.makedirs(tmp_path / "b" / "bebe_0.png.tmp")
+    summary = run([parse_config({"id": "b", "phases": "Bebê"}, 2)], tmp_path, backend)
+    assert summary["failed"] == 1
+    with open(tmp_path / RESULTS_FILE, encoding="utf-8") as f:
+        assert json.loads(f.read().splitlines()[-1])["status"] == "failed"
+
+
+def test_repeated_phases_and_seeds_are_dropped():
+    config = parse_config({"id": "a", "phases": "Bebê;Bebê;Criança", "seeds": "1;1;2"}, 2)
+    assert config["phases"] == ["Bebê", "Criança"] and config["seeds"] == [1, 2]
+
+
+@pytest.mark.parametrize("config_id", ["..", ".", "../fora", "a/b", "a\\b", "C:"])
+def test_ids_that_escape_the_output_dir_are_rejected(config_id):
+    with pytest.raises(ManifestError):
+        parse_config({"id": config_id}, 2)
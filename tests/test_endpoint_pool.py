@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import APIError, InferenceBackend  # noqa: E402
+from endpoint_pool import CIRCUIT_CLOSED, EndpointPool  # noqa: E402
+
+
+class FlakyBackend(InferenceBackend):
+    """Falha com 503 enquanto `failing` for verdadeiro; depois responde normalmente."""
+
+    requires_api_key = False
+
+    def __init__(self, name):
+        self.name = name
+        self.url = f"http://{name}"
+        self.failing = True
+        self.calls = 0
+        self.headers = None
+
+    def generate(self, payload, headers, read_timeout):
+        self.calls += 1
+        self.headers = headers
+        if self.failing:
+            raise APIError(503, "fora do ar")
+        return self.name.encode("utf-8")
+
+
+class ScriptedBackend(FlakyBackend):
+    """Responde depois de `delay` segundos com a imagem ou, com `status`, com esse erro."""
+
+    def __init__(self, name, delay=0.0, status=None):
+        super().__init__(name)
+        self.delay = delay
+        self.status = status
+
+    def generate(self, payload, headers, read_timeout):
+        time.sleep(self.delay)
+        if self.status is not None:
+            raise APIError(self.status, "recusado")
+        return self.name.encode("utf-8")
+
+
+def test_recovered_endpoints_do_not_stay_half_open():
+    backends = [FlakyBackend("a"), FlakyBackend("b")]
+    pool = EndpointPool(backends, hedge=False, failure_threshold=1, reset_timeout=0.05)
+    try:
+        for _ in range(2):
+            try:
+                pool.generate({}, {}, 1.0)
+            except APIError:
+                pass
+        assert [endpoint["state"] for endpoint in pool.stats()["endpoints"]] == ["open", "open"]
+
+        for backend in backends:
+            backend.failing = False
+        time.sleep(0.1)
+        for _ in range(5):
+            pool.generate({}, {}, 1.0)
+        pool.check_health()
+
+        assert [endpoint["state"] for endpoint in pool.stats()["endpoints"]] == [CIRCUIT_CLOSED, CIRCUIT_CLOSED]
+        assert backends[1].calls > 1
+    finally:
+        pool.close()
+
+
+def test_api_key_only_sent_to_endpoints_that_require_it():
+    hosted, local = FlakyBackend("hf"), FlakyBackend("local")
+    hosted.requires_api_key = True
+    hosted.failing = local.failing = False
+    pool = EndpointPool([hosted, local], hedge=False)
+    try:
+        for endpoint in pool._endpoints:
+            pool._call(endpoint, {}, {"Authorization": "Bearer hf_x", "x-use-cache": "false"}, 1.0)
+        assert hosted.headers == {"Authorization": "Bearer hf_x", "x-use-cache": "false"}
+        assert local.headers == {"x-use-cache": "false"}
+    finally:
+        pool.close()
+
+
+def test_hedged_client_error_waits_for_the_primary():
+    pool = EndpointPool([ScriptedBackend("lento", delay=0.3), ScriptedBackend("recusa", status=400)], hedge=True, hedge_delay=0.05)
+    try:
+        assert pool.generate({}, {}, 1.0) == b"lento"
+        assert pool.stats()["hedges"] == 1
+    finally:
+        pool.close()
+
+
+def test_hedged_client_error_is_raised_when_both_requests_fail():
+    pool = EndpointPool([ScriptedBackend("lento", delay=0.3, status=503), ScriptedBackend("recusa", status=400)], hedge=True, hedge_delay=0.05)
+    try:
+        with pytest.raises(APIError) as raised:
+            pool.generate({}, {}, 1.0)
+        assert raised.value.status_code == 400
+    finally:
+        pool.close()
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import APIError, build_http_session, create_backend  # noqa: E402
+import generation  # noqa: E402
+from generation import request_with_retry  # noqa: E402
+from stub_server import start_in_background  # noqa: E402
+
+PAYLOAD = {"inputs": "bebê", "parameters": {"seed": 1, "width": 16, "height": 16}}
+
+
+@pytest.fixture
+def stub():
+    server, url = start_in_background(port=0, size=16, loading_rate=1.0, estimated_time=500)
+    yield server, create_backend("stub", build_http_session(2), url=url)
+    server.shutdown()
+    server.server_close()
+
+
+def test_long_estimated_time_waits_out_the_deadline_before_the_last_attempt(stub):
+    server, backend = stub
+    delays = []
+
+    def on_retry(error, delay, attempt):
+        delays.append(delay)
+        # O modelo termina de carregar durante a espera
+        server.loading_rate = 0.0
+
+    started = time.monotonic()
+    image_bytes = request_with_retry(PAYLOAD, {}, backend, deadline=1.0, on_retry=on_retry, last_attempt=0.5)
+    assert image_bytes.startswith(b"\x89PNG")
+    assert len(delays) == 1 and 0.3 < delays[0] <= 0.5
+    assert time.monotonic() - started < 1.0
+
+
+def test_gives_up_at_the_deadline_when_the_model_never_loads(stub):
+    _, backend = stub
+    started = time.monotonic()
+    with pytest.raises(APIError) as raised:
+        request_with_retry(PAYLOAD, {}, backend, deadline=1.0, last_attempt=0.5)
+    assert raised.value.status_code == 503
+    assert 0.4 < time.monotonic() - started < 1.0
+
+
+def test_backoff_retries_transient_errors(stub, monkeypatch):
+    server, backend = stub
+    monkeypatch.setattr(generation, "RETRY_BASE_DELAY", 0.01)
+    server.loading_rate, server.estimated_time = 0.0, 0.0
+    server.error_rate = 1.0
+    attempts = []
+
+    def on_retry(error, delay, attempt):
+        attempts.append((error.status_code, attempt))
+        if attempt == 2:
+            server.error_rate = 0.0
+
+    assert request_with_retry(PAYLOAD, {}, backend, deadline=30.0, on_retry=on_retry).startswith(b"\x89PNG")
+    assert attempts == [(500, 1), (500, 2)]
@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobManager, MemoryJobStore, SQLiteJobStore, _new_record  # noqa: E402
+
+
+def make_record(status, worker=None, age=0.0):
+    record = _new_record("sessao", "single", "", 1)
+    record.update(status=status, updated=time.time() - age)
+    if worker is not None:
+        record["worker"] = worker
+    return record
+
+
+def test_jobs_of_a_previous_process_with_the_same_pid_are_failed(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    store = SQLiteJobStore(path)
+    running, queued = make_record(JOB_RUNNING), make_record(JOB_QUEUED)
+    store.create(running)
+    store.create(queued)
+
+    # Mesmo host e mesmo PID, como o processo do Streamlit após reiniciar o contêiner
+    reopened = SQLiteJobStore(path)
+    assert reopened.get(running["id"])["status"] == JOB_FAILED
+    assert reopened.get(queued["id"])["status"] == JOB_FAILED
+
+
+def test_stale_jobs_of_other_replicas_are_failed(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    store = SQLiteJobStore(path, stale_after=60)
+    stale, active = make_record(JOB_RUNNING, "outra-maquina:1", age=120), make_record(JOB_RUNNING, "outra-maquina:1")
+    store.create(stale)
+    store.create(active)
+
+    # Consultado no banco já aberto: a sessão que acompanha o job deixa de esperar
+    assert store.get(stale["id"])["status"] == JOB_FAILED
+    assert store.get(active["id"])["status"] == JOB_RUNNING
+
+    late = make_record(JOB_QUEUED, "outra-maquina:2", age=120)
+    store.create(late)
+    assert SQLiteJobStore(path, stale_after=60).get(late["id"])["status"] == JOB_FAILED
+    assert SQLiteJobStore(path).get(active["id"])["status"] == JOB_RUNNING
+
+
+def test_job_waiting_for_admission_does_not_hold_a_worker():
+    manager = JobManager(MemoryJobStore(), max_workers=1)
+    turn = threading.Event()
+    blocked = manager.submit("a", "single", lambda context: "a", admit=lambda context: turn.wait(5))
+    free = manager.submit("b", "single", lambda context: "b", admit=lambda context: None)
+
+    manager.wait(free, 2)
+    assert manager.get(free)["status"] == JOB_DONE
+    assert manager.get(blocked)["status"] == JOB_QUEUED
+
+    turn.set()
+    manager.wait(blocked, 2)
+    assert manager.get(blocked)["status"] == JOB_DONE and manager.get(blocked)["result"] == "a"
+
+
+def test_job_is_failed_when_admission_times_out():
+    def admit(context):
+        raise TimeoutError("fila cheia")
+
+    manager = JobManager(MemoryJobStore(), max_workers=1)
+    job_id = manager.submit("a", "single", lambda context: "a", admit=admit)
+    manager.wait(job_id, 2)
+    record = manager.get(job_id)
+    assert record["status"] == JOB_FAILED and record["error"]["message"] == "fila cheia"
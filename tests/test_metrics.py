@@ -0,0 +1,16 @@
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core  # noqa: E402
+
+
+def test_metrics_port_in_use_does_not_break_the_app(monkeypatch):
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        monkeypatch.setattr(core, "METRICS_HOST", "127.0.0.1")
+        monkeypatch.setattr(core, "METRICS_PORT", taken.getsockname()[1])
+        assert core.start_metrics() is None
@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompts import (  # noqa: E402
+    AGE_PROMPTS, BASE_PROMPT_TEMPLATE, GENDERS, PHASES, PROMPTS, PROMPTS_BY_KEY, SKIN_TONES, get_prompt, prompt_key, replace_terms,
+)
+
+# Cadeia de str.replace da versão original do app, usada como referência
+LEGACY_REPLACEMENTS = {
+    'Menino': (('newborn baby', 'newborn baby boy'), ('child', 'boy'), ('teenager', 'male teenager'), ('adult', 'man')),
+    'Menina': (('newborn baby', 'newborn baby girl'), ('child', 'girl'), ('teenager', 'female teenager'), ('adult', 'woman')),
+}
+
+
+def legacy_prompt(phase, gender, skin_tone):
+    age_desc = AGE_PROMPTS[phase]
+    for old, new in LEGACY_REPLACEMENTS[gender]:
+        age_desc = age_desc.replace(old, new)
+    return BASE_PROMPT_TEMPLATE.format(age_desc=age_desc, skin_tone=SKIN_TONES[skin_tone])
+
+
+def test_all_48_prompts_are_compiled():
+    assert len(PROMPTS) == len(PHASES) * len(GENDERS) * len(SKIN_TONES) == 48
+    assert len(PROMPTS_BY_KEY) == 48
+
+
+def test_prompts_match_the_original_replacements():
+    for (phase, gender, skin_tone), prompt in PROMPTS.items():
+        assert prompt.text == legacy_prompt(phase, gender, skin_tone)
+        assert prompt.key == prompt_key(prompt.text)
+        assert get_prompt(phase, gender, skin_tone) is prompt
+
+
+def test_skin_tone_is_substituted():
+    for skin_tone, description in SKIN_TONES.items():
+        text = get_prompt('Criança', 'Menina', skin_tone).text
+        assert f", {description}, cinematic lighting" in text
+        assert "{" not in text and "}" not in text
+
+
+def test_terms_are_replaced_as_whole_words():
+    terms = {('child',): 'boy', ('newborn', 'baby'): 'newborn baby boy'}
+    assert replace_terms("cute child, childhood photo", terms) == "cute boy, childhood photo"
+    assert replace_terms("a newborn  baby", terms) == "a newborn baby boy"
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generation import fetch_image  # noqa: E402
+from result_cache import ResultCache, payload_key  # noqa: E402
+
+
+class CountingBackend:
+    name = "contador"
+    url = "http://contador"
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, payload, headers, read_timeout):
+        self.calls += 1
+        return f"imagem {self.calls}".encode("utf-8")
+
+
+def test_disk_tier_evicts_oldest_files_over_the_cap(tmp_path):
+    cache = ResultCache(0, directory=str(tmp_path), max_disk_bytes=3000)
+    keys = [payload_key({"inputs": str(index)}, "http://x") for index in range(5)]
+    for key in keys[:3]:
+        cache.put(key, b"x" * 1000)
+        time.sleep(0.01)
+    # Lida agora, a primeira entrada passa à frente da segunda
+    assert cache.get(keys[0]) is not None
+    for key in keys[3:]:
+        cache.put(key, b"x" * 1000)
+        time.sleep(0.01)
+
+    assert [cache.contains(key) for key in keys] == [True, False, False, True, True]
+
+
+def test_fresh_results_are_not_cached():
+    backend, cache = CountingBackend(), ResultCache(1024 * 1024)
+    payload = {"inputs": "bebê", "parameters": {"seed": 123}}
+    fetch_image(payload, {}, backend, cache, fresh=True)
+    assert not cache.contains(payload_key(payload, backend.url))
+
+    fetch_image(payload, {}, backend, cache, fresh=True, store=True)
+    assert cache.contains(payload_key(payload, backend.url))
@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import PRIORITY_GRID, PRIORITY_SINGLE, FairScheduler, QueueTimeout  # noqa: E402
+
+
+def make_scheduler(global_rate=20.0, global_burst=1):
+    # Só o limite global importa nestes testes: os de sessão e de chave ficam folgados
+    return FairScheduler(global_rate, global_burst, 1000.0, 1000.0, 1000.0, 1000.0)
+
+
+def run_requests(scheduler, requests):
+    """Enfileira os pedidos (sessão, prioridade) nesta ordem e retorna a ordem em que foram liberados."""
+    admitted = []
+    lock = threading.Lock()
+
+    def request(session_id, priority):
+        scheduler.acquire(session_id, "", priority, timeout=10)
+        with lock:
+            admitted.append(session_id)
+
+    threads = []
+    for session_id, priority in requests:
+        thread = threading.Thread(target=request, args=(session_id, priority))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+    return admitted
+
+
+def test_other_sessions_are_not_starved_by_a_busy_one():
+    admitted = run_requests(make_scheduler(), [("a", PRIORITY_GRID)] * 4 + [("b", PRIORITY_GRID)])
+    assert admitted[:2] == ["a", "b"]
+
+
+def test_single_images_go_before_grids():
+    admitted = run_requests(make_scheduler(), [("a", PRIORITY_GRID)] * 3 + [("b", PRIORITY_SINGLE)])
+    assert admitted[:2] == ["a", "b"]
+
+
+def test_queue_timeout():
+    scheduler = make_scheduler(global_rate=0.1)
+    scheduler.acquire("a", "", PRIORITY_GRID)
+    started = time.monotonic()
+    with pytest.raises(QueueTimeout):
+        scheduler.acquire("b", "", PRIORITY_GRID, timeout=0.2)
+    assert 0.2 <= time.monotonic() - started < 1.0
+    assert scheduler.stats() == {"queued": 0, "admitted": 1, "timeouts": 1}
+
+
+def test_on_wait_runs_outside_the_queue_lock():
+    scheduler = make_scheduler(global_rate=5.0)
+    scheduler.acquire("a", "", PRIORITY_GRID)
+    reached = []
+
+    def on_wait(position, estimated):
+        # Um callback lento (ex.: gravar o progresso no SQLite) não pode travar a fila das outras sessões
+        other = threading.Thread(target=lambda: reached.append(scheduler.stats()))
+        other.start()
+        other.join(timeout=1.0)
+        assert not other.is_alive()
+
+    scheduler.acquire("b", "", PRIORITY_GRID, on_wait=on_wait, timeout=5)
+    assert reached and reached[0]["queued"] == 1
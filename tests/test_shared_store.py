@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import issue_resume_token, resume_session  # noqa: E402
+from shared_store import MemorySharedStore, SQLiteSharedStore  # noqa: E402
+
+
+def test_memory_store_drops_expired_records_on_put():
+    store = MemorySharedStore()
+    for index in range(100):
+        store.put(f"resume:{index}", b"sessao", 0.01)
+    time.sleep(0.02)
+    store.put("resume:novo", b"sessao", 60)
+    assert list(store._records) == ["resume:novo"]
+
+
+def test_resume_token_is_single_use():
+    store = MemorySharedStore()
+    session_id = "ab" * 16
+    token = issue_resume_token(store, session_id)
+    assert session_id not in token
+    assert resume_session(store, token) == session_id
+    assert resume_session(store, token) is None
+    assert resume_session(store, "") is None
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_put_evicts_the_oldest_records_over_max_bytes(tmp_path, kind):
+    if kind == "memory":
+        stores = [MemorySharedStore(max_bytes=250)] * 2
+    else:
+        # Duas réplicas no mesmo banco: o limite vale para os dados de todas somados
+        stores = [SQLiteSharedStore(str(tmp_path / "shared.db"), max_bytes=250) for _ in range(2)]
+    for index in range(4):
+        stores[index % 2].put(f"img:{index}", bytes(100), 60)
+        time.sleep(0.01)
+    assert [stores[0].contains(f"img:{index}") for index in range(4)] == [False, False, True, True]
@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from shared_store import SQLiteSharedStore  # noqa: E402
+from single_flight import SingleFlight  # noqa: E402
+
+
+class InvalidKey(Exception):
+    pass
+
+
+def run_together(count, call):
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(call())
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results, errors
+
+
+def test_identical_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        time.sleep(0.2)
+        return b"imagem"
+
+    results, errors = run_together(5, lambda: flight.do("bebe", generate))
+    assert results == [b"imagem"] * 5 and not errors
+    assert len(calls) == 1
+    assert flight.stats() == {"executed": 1, "coalesced": 4, "coalesced_remote": 0, "in_flight": 0}
+
+
+def test_followers_rerun_after_the_leader_credential_error():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def leader():
+        started.set()
+        time.sleep(0.2)
+        raise InvalidKey()
+
+    thread = threading.Thread(target=lambda: pytest.raises(InvalidKey, flight.do, "bebe", leader))
+    thread.start()
+    started.wait()
+    # A chave de quem iniciou é inválida: quem esperava gera com a própria chave em vez de herdar o erro
+    assert flight.do("bebe", lambda: b"imagem", rerun_on=lambda error: isinstance(error, InvalidKey)) == b"imagem"
+    thread.join()
+    assert flight.stats()["executed"] == 2
+
+
+def test_replicas_sharing_sqlite_run_once(tmp_path, monkeypatch):
+    monkeypatch.setattr("single_flight.CLAIM_POLL_INTERVAL", 0.01)
+    path = str(tmp_path / "shared.db")
+    cache = {}
+    calls = []
+
+    def generate():
+        # Como o cache compartilhado: quem espera a outra réplica encontra o resultado pronto
+        if "bebe" not in cache:
+            calls.append(1)
+            time.sleep(0.2)
+            cache["bebe"] = b"imagem"
+        return cache["bebe"]
+
+    flights = [SingleFlight(SQLiteSharedStore(path)) for _ in range(2)]
+    flights[1]._owner = "outra-replica:1"
+    results = []
+    threads = [threading.Thread(target=lambda flight=flight: results.append(flight.do("bebe", generate))) for flight in flights]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert results == [b"imagem"] * 2
+    assert len(calls) == 1
+    assert sum(flight.stats()["coalesced_remote"] for flight in flights) == 1
@@ -0,0 +1,59 @@
+import io
+import os
+
+from PIL import Image, ImageOps
+
+from imaging import encode_image
+
+# Limites das fotos enviadas: tamanho do arquivo (MB) e resolução (megapixels)
+UPLOAD_MAX_MB = float(os.environ.get("AIBABY_UPLOAD_MAX_MB", "10"))
+UPLOAD_MAX_MEGAPIXELS = float(os.environ.get("AIBABY_UPLOAD_MAX_MEGAPIXELS", "50"))
+
+# Formatos aceitos, conforme identificados pelo cabeçalho do arquivo (a extensão não é confiável)
+UPLOAD_FORMATS = ("JPEG", "PNG")
+
+# Lado máximo (px) da miniatura exibida no lugar da foto original
+PREVIEW_SIZE = int(os.environ.get("AIBABY_PREVIEW_SIZE", "512"))
+
+
+class UploadError(ValueError):
+    """A foto enviada foi recusada (arquivo grande demais, formato não suportado ou resolução excessiva)."""
+
+
+def check_upload_size(size):
+    """Recusa o arquivo pelo tamanho informado no upload, antes de ler o conteúdo."""
+    if size > UPLOAD_MAX_MB * 1024 * 1024:
+        raise UploadError(f"A foto tem {size / (1024 * 1024):.1f} MB; o limite é {UPLOAD_MAX_MB:g} MB.")
+
+
+def inspect_upload(data):
+    """Valida a foto lendo apenas o cabeçalho (formato e dimensões) e retorna a imagem ainda não decodificada."""
+    check_upload_size(len(data))
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError:
+        raise UploadError(f"A foto excede o limite de {UPLOAD_MAX_MEGAPIXELS:g} megapixels.") from None
+    except (OSError, SyntaxError):
+        raise UploadError("Não foi possível ler a foto; envie um arquivo JPEG ou PNG válido.") from None
+    if image.format not in UPLOAD_FORMATS:
+        raise UploadError(f"Formato {image.format} não suportado; envie uma foto JPEG ou PNG.")
+    width, height = image.size
+    if width * height > UPLOAD_MAX_MEGAPIXELS * 1_000_000:
+        raise UploadError(f"A foto tem {width}x{height} pixels; o limite é {UPLOAD_MAX_MEGAPIXELS:g} megapixels.")
+    return image
+
+
+def make_preview(data, size=PREVIEW_SIZE):
+    """Valida a foto e retorna os bytes JPEG de uma miniatura com no máximo `size` px de lado.
+
+    JPEGs são decodificados já em escala reduzida (`draft`), sem carregar a resolução completa; a
+    miniatura é girada conforme a orientação EXIF, como a foto enviada ao modelo (ver conditioning.py)."""
+    image = inspect_upload(data)
+    if image.format == "JPEG":
+        image.draft("RGB", (size, size))
+    try:
+        image.thumbnail((size, size))
+        image = ImageOps.exif_transpose(image)
+    except (OSError, SyntaxError):
+        raise UploadError("A foto está corrompida; envie outro arquivo.") from None
+    return encode_image(image, "JPEG", quality=85)